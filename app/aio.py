@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+from flask import abort, current_app, g, render_template, request, session
+from flask_login import current_user
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+from models import Book, Visit, VisitDaily
+from queries import Page, book_row, detail_select, refs_select, ordered_refs, reviews_query, reviews_result, own_review_select, CATALOGUE_OPTIONS
+from keyset import keyset_query, keyset_result, RELTUPLES
+from rollups import views_select
+from cache import result_cache
+from perf import perf_monitor
+from leaderboard import leaderboard
+from recommend import recommender
+from exports import parse_period, views_report_columns
+from books import book_page, index as sync_index
+from stats import admin_allowed, period_invalid
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+
+def async_url(uri):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def settle(future, task):
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+class AsyncDatabase:
+    def __init__(self, app=None):
+        self.engines  = {}
+        self.sessions = {}
+        self._loop    = None
+        self._started = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASYNC_MODE', False)
+        app.extensions['async_db'] = self
+        if not app.config['ASYNC_MODE']:
+            return
+        uris = {None: app.config['SQLALCHEMY_DATABASE_URI'], **app.config.get('SQLALCHEMY_BINDS', {})}
+        timeout = app.config.get('DB_STATEMENT_TIMEOUT')
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        pool = {name: options[name] for name in POOL_OPTIONS if name in options}
+        for key, uri in uris.items():
+            url = async_url(uri)
+            connect_args = {}
+            if timeout and url.get_backend_name() == 'postgresql':
+                connect_args['server_settings'] = {'statement_timeout': str(timeout)}
+            engine = create_async_engine(url, connect_args=connect_args, **pool)
+            perf_monitor.watch(engine.sync_engine)
+            self.engines[key]  = engine
+            self.sessions[key] = async_sessionmaker(engine, expire_on_commit=False)
+        for endpoint, view in ASYNC_VIEWS.items():
+            app.view_functions[endpoint] = view
+
+    def attach_loop(self, loop):
+        if self._loop is None:
+            self._loop = loop
+
+    def ensure_loop(self):
+        if self._loop is not None:
+            return self._loop
+        with self._started:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-db', daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def async_to_sync(self, func):
+        return lambda *args, **kwargs: self.run(func(*args, **kwargs))
+
+    def run(self, coro):
+        loop, done = self.ensure_loop(), Future()
+        def start():
+            loop.create_task(coro).add_done_callback(lambda task: settle(done, task))
+        loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return done.result()
+
+    def session(self):
+        return self.sessions[g.get('_db_replica')]()
+
+    async def scalar(self, stmt, params=None):
+        async with self.session() as s:
+            return await s.scalar(stmt, params)
+
+    async def scalars(self, stmt):
+        async with self.session() as s:
+            return (await s.scalars(stmt)).unique().all()
+
+    async def rows(self, stmt):
+        async with self.session() as s:
+            return (await s.execute(stmt)).all()
+
+async_db = AsyncDatabase()
+
+async def approx_count(model):
+    if async_db.engines[None].dialect.name == 'postgresql':
+        estimate = await async_db.scalar(RELTUPLES, {'name': model.__tablename__})
+        if estimate and estimate > 0:
+            return estimate
+    return await async_db.scalar(select(func.count(model.id)))
+
+async def rolled_until():
+    return await async_db.scalar(select(func.max(VisitDaily.day)))
+
+async def catalogue_summary(page, per_page=10):
+    books, total = await asyncio.gather(
+        async_db.scalars(
+            select(Book).options(*CATALOGUE_OPTIONS)
+            .order_by(Book.year.desc(), Book.id.desc())
+            .limit(per_page).offset((page - 1) * per_page)
+        ),
+        async_db.scalar(select(func.count(Book.id))),
+    )
+    return Page([book_row(b) for b in books], page, per_page, total)
+
+async def book_refs(book_ids):
+    if not book_ids:
+        return []
+    return ordered_refs(await async_db.rows(refs_select(book_ids)), book_ids)
+
+async def load_index(page, recent_ids):
+    return await asyncio.gather(
+        result_cache.aget_or_set(
+            'catalogue', f'{page}:',
+            lambda: catalogue_summary(page),
+            ttl=current_app.config['CACHE_CATALOGUE_TTL'],
+        ),
+        book_refs(recent_ids),
+    )
+
+async def index(page=1):
+    if request.args.get('q', '').strip() or current_app.config['CATALOGUE_PAGINATION'] == 'keyset':
+        return await asyncio.to_thread(sync_index, page)
+    (paginated, recent), popular = await asyncio.gather(
+        load_index(page, session.get('recent_books')),
+        asyncio.to_thread(leaderboard.top),
+    )
+    return await asyncio.to_thread(render_template, 'index.html', pagination=paginated, q='', popular=popular, recent=recent)
+
+async def load_book(book_id, user_id):
+    query, after, before = reviews_query(book_id)
+    own = own_review_select(book_id, user_id) if user_id is not None else None
+    books, rows, user_review, similar = await asyncio.gather(
+        async_db.scalars(detail_select(book_id)),
+        async_db.rows(query),
+        async_db.scalar(own) if own is not None else asyncio.sleep(0),
+        book_refs(recommender.similar(book_id)),
+    )
+    return books, reviews_result(rows, after, before), user_review, similar
+
+async def book_detail(book_id):
+    user_id = current_user.id if current_user.is_authenticated else None
+    books, reviews, user_review, similar = await load_book(book_id, user_id)
+    if not books:
+        abort(404)
+    return await asyncio.to_thread(book_page, books[0], reviews, user_review, similar)
+
+async def load_actions(after, before):
+    query, after, before = keyset_query(
+        select(Visit).options(joinedload(Visit.user), joinedload(Visit.book)),
+        Visit.timestamp, Visit.id,
+        after=after,
+        before=before,
+    )
+    rows, total = await asyncio.gather(async_db.scalars(query), approx_count(Visit))
+    return keyset_result(list(rows), Visit.timestamp, Visit.id, after, before, total=total)
+
+@admin_allowed
+async def stats_actions():
+    pagination = await load_actions(request.args.get('after'), request.args.get('before'))
+    return await asyncio.to_thread(render_template, 'stats_actions.html', pagination=pagination)
+
+async def load_views(period_from, period_to, page):
+    views = views_select(await rolled_until(), period_from, period_to, authenticated_only=True)
+    report = select(*views_report_columns(views)).join(views, views.c.book_id == Book.id)
+    items, total = await asyncio.gather(
+        async_db.rows(report.order_by(views.c.cnt.desc()).limit(10).offset((page - 1) * 10)),
+        async_db.scalar(select(func.count()).select_from(report.subquery())),
+    )
+    return Page(items, page, 10, total)
+
+@admin_allowed
+async def stats_views():
+    invalid = period_invalid('stats.stats_views')
+    if invalid:
+        return invalid
+    date_from = request.values.get('date_from')
+    date_to   = request.values.get('date_to')
+    page      = request.args.get('page', 1, type=int)
+
+    period_from, period_to = parse_period(date_from, date_to)
+    return await asyncio.to_thread(
+        render_template,
+        'stats_views.html',
+        pagination=await load_views(period_from, period_to, page),
+        date_from=date_from,
+        date_to=date_to
+    )
+
+ASYNC_VIEWS = {
+    'main.index':          index,
+    'main.book_detail':    book_detail,
+    'stats.stats_actions': stats_actions,
+    'stats.stats_views':   stats_views,
+}
@@ -0,0 +1,193 @@
+import array
+import heapq
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+MAGIC   = b'VCOL2\n'
+TRAILER = struct.Struct('<QI')
+BLOCK_ROWS = 16384
+EPOCH   = datetime(1970, 1, 1)
+MICRO   = timedelta(microseconds=1)
+NO_USER = 0
+INT_COLUMNS = ('id', 'book_id', 'user_id', 'timestamp', 'visit_date')
+FILE_RE = re.compile(r'^visits_(\d{4})_(\d{2})\.vcol$')
+
+def to_micros(ts):
+    return (ts - EPOCH) // MICRO
+
+def from_micros(value):
+    return EPOCH + value * MICRO
+
+def encode_block(rows):
+    cols = {name: array.array('q') for name in INT_COLUMNS}
+    sessions = []
+    for visit_id, book_id, user_id, session_id, ts, visit_date in rows:
+        cols['id'].append(visit_id)
+        cols['book_id'].append(book_id)
+        cols['user_id'].append(user_id or NO_USER)
+        cols['timestamp'].append(to_micros(ts))
+        cols['visit_date'].append(visit_date.toordinal())
+        sessions.append(session_id)
+    blobs = {name: zlib.compress(col.tobytes()) for name, col in cols.items()}
+    blobs['session_id'] = zlib.compress('\n'.join(sessions).encode('utf-8'))
+    stamps, days = cols['timestamp'], cols['visit_date']
+    info = {'rows': len(sessions), 'ts_from': stamps[0], 'ts_to': stamps[-1], 'day_from': min(days), 'day_to': max(days)}
+    return info, blobs
+
+def merged(old, new):
+    last = None
+    for row in heapq.merge(old, new, key=lambda row: (row[4], row[0])):
+        if row[0] != last:
+            yield row
+        last = row[0]
+
+def write_archive(path, rows, block_rows=BLOCK_ROWS):
+    old = ArchiveFile(path) if os.path.exists(path) else None
+    if old is not None:
+        rows = merged(old.rows(), rows)
+    blocks, total, offset = [], 0, len(MAGIC)
+    try:
+        with open(path + '.part', 'wb') as out:
+            out.write(MAGIC)
+            rows = iter(rows)
+            while True:
+                chunk = list(islice(rows, block_rows))
+                if not chunk:
+                    break
+                info, blobs = encode_block(chunk)
+                info['columns'] = {}
+                for name, blob in blobs.items():
+                    info['columns'][name] = [offset, len(blob)]
+                    out.write(blob)
+                    offset += len(blob)
+                blocks.append(info)
+                total += info['rows']
+            header = json.dumps({
+                'rows':      total,
+                'byteorder': sys.byteorder,
+                'date_from': date.fromordinal(min(b['day_from'] for b in blocks)).isoformat() if blocks else None,
+                'date_to':   date.fromordinal(max(b['day_to'] for b in blocks)).isoformat() if blocks else None,
+                'blocks':    blocks,
+            }).encode('utf-8')
+            out.write(header)
+            out.write(TRAILER.pack(offset, len(header)))
+    finally:
+        if old is not None:
+            old.close()
+    os.replace(path + '.part', path)
+    return total - (old.rows_total if old is not None else 0)
+
+class ArchiveFile:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            if self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path}: не архив просмотров')
+            self._file.seek(-TRAILER.size, os.SEEK_END)
+            offset, size = TRAILER.unpack(self._file.read(TRAILER.size))
+            self._file.seek(offset)
+            self.header = json.loads(self._file.read(size))
+        except Exception:
+            self._file.close()
+            raise
+        self.rows_total = self.header['rows']
+        self.swap = self.header['byteorder'] != sys.byteorder
+
+    def _column(self, block, name):
+        offset, length = block['columns'][name]
+        self._file.seek(offset)
+        raw = zlib.decompress(self._file.read(length))
+        if name == 'session_id':
+            return raw.decode('utf-8').split('\n') if block['rows'] else []
+        col = array.array('q')
+        col.frombytes(raw)
+        if self.swap:
+            col.byteswap()
+        return col
+
+    def blocks(self, names, ts_from=None, ts_to=None, reverse=False):
+        blocks = self.header['blocks']
+        for block in reversed(blocks) if reverse else blocks:
+            if (ts_from is not None and block['ts_to'] < ts_from) or (ts_to is not None and block['ts_from'] >= ts_to):
+                continue
+            yield [self._column(block, name) for name in names]
+
+    def rows(self):
+        for ids, books, users, sessions, stamps, days in self.blocks(('id', 'book_id', 'user_id', 'session_id', 'timestamp', 'visit_date')):
+            for n in range(len(ids)):
+                yield (ids[n], books[n], users[n] if users[n] != NO_USER else None, sessions[n],
+                       from_micros(stamps[n]), date.fromordinal(days[n]))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class VisitArchive:
+    def __init__(self, app=None):
+        self.folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISITS_ARCHIVE_FOLDER', os.path.join(app.instance_path, 'visits_archive'))
+        app.config.setdefault('VISITS_PARTITIONS_AHEAD', 3)
+        app.config.setdefault('VISITS_RETENTION_MONTHS', 12)
+        self.folder = app.config['VISITS_ARCHIVE_FOLDER']
+        app.extensions['visit_archive'] = self
+
+    def path(self, month):
+        return os.path.join(self.folder, f'visits_{month:%Y_%m}.vcol')
+
+    def months(self, date_from=None, date_to=None):
+        if not os.path.isdir(self.folder):
+            return []
+        found = []
+        for name in os.listdir(self.folder):
+            m = FILE_RE.match(name)
+            if not m:
+                continue
+            month = date(int(m[1]), int(m[2]), 1)
+            last = (month.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            if (date_from is None or last >= date_from) and (date_to is None or month <= date_to):
+                found.append(month)
+        return sorted(found)
+
+    def write(self, month, rows):
+        os.makedirs(self.folder, exist_ok=True)
+        return write_archive(self.path(month), rows)
+
+    def open(self, month):
+        return ArchiveFile(self.path(month))
+
+    def daily(self, before=None):
+        counts = Counter()
+        for month in self.months(date_to=before):
+            with self.open(month) as part:
+                for books, users, days in part.blocks(('book_id', 'user_id', 'visit_date')):
+                    for book_id, user_id, day in zip(books, users, days):
+                        counts[book_id, day, user_id != NO_USER] += 1
+        limit = before.toordinal() if before else None
+        daily = {}
+        for (book_id, day, known), n in counts.items():
+            if limit is not None and day >= limit:
+                continue
+            row = daily.setdefault((book_id, day), [0, 0])
+            row[0 if known else 1] += n
+        return [
+            {'book_id': book_id, 'day': date.fromordinal(day), 'authenticated_views': known, 'anonymous_views': anonymous}
+            for (book_id, day), (known, anonymous) in daily.items()
+        ]
+
+visit_archive = VisitArchive()
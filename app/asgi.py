@@ -0,0 +1,12 @@
+import asyncio
+import os
+from a2wsgi import WSGIMiddleware
+from app import app
+from aio import async_db
+
+class LibraryAsgi(WSGIMiddleware):
+    async def __call__(self, scope, receive, send):
+        async_db.attach_loop(asyncio.get_running_loop())
+        await super().__call__(scope, receive, send)
+
+asgi_app = LibraryAsgi(app, workers=int(os.environ.get('ASGI_THREADS', 10)))
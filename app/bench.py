@@ -0,0 +1,321 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from sqlalchemy import exists, select, true
+from app import app
+from models import db, Book, Review, User
+from querycount import count_queries
+from gen_data import WORDS, READER_PASSWORD
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_results')
+ADMIN = ('admin', 'qwerty')
+REVIEWERS = 50
+
+class Scenario:
+    def __init__(self, name, login=None, method='GET'):
+        self.name   = name
+        self.login  = login
+        self.method = method
+
+    def request(self, rnd, ctx):
+        raise NotImplementedError
+
+    def pick(self, rnd, ctx):
+        return None, *self.request(rnd, ctx)
+
+    def skipped(self, ctx):
+        if self.login and ctx['users'][self.login] is None:
+            return f'нет пользователя {self.login}'
+
+class Index(Scenario):
+    def request(self, rnd, ctx):
+        return f"/page/{rnd.randint(1, ctx['pages'])}", None
+
+class Search(Scenario):
+    def request(self, rnd, ctx):
+        return '/?' + urllib.parse.urlencode({'q': rnd.choice(WORDS)}), None
+
+class Detail(Scenario):
+    def request(self, rnd, ctx):
+        return f"/books/{rnd.choice(ctx['book_ids'])}", None
+
+class ReviewSubmit(Scenario):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._next = itertools.count()
+
+    def pick(self, rnd, ctx):
+        pairs = ctx['review_pairs']
+        user, book_id = pairs[next(self._next) % len(pairs)]
+        data = {'rating': rnd.randint(0, 5), 'text': ' '.join(rnd.choice(WORDS) for _ in range(50))}
+        return user, f"/books/{book_id}/review", data
+
+    def skipped(self, ctx):
+        if not ctx['review_pairs']:
+            return 'нет пар читатель–книга без рецензии'
+
+class ExportLog(Scenario):
+    def request(self, rnd, ctx):
+        return f"/stats/logs/export?date_from={ctx['export_from']}", None
+
+class ExportViews(Scenario):
+    def request(self, rnd, ctx):
+        return '/stats/views/export', None
+
+SCENARIOS = [
+    Index('index'),
+    Search('search'),
+    Detail('book_detail'),
+    ReviewSubmit('review', login='reader', method='POST'),
+    ExportLog('export_log', login='admin'),
+    ExportViews('export_views', login='admin'),
+]
+
+def review_pairs(readers, limit):
+    if not readers:
+        return []
+    reviewed = exists().where(Review.user_id == User.id, Review.book_id == Book.id)
+    rows = db.session.execute(
+        select(User.id, User.login, Book.id)
+        .join(Book, true())
+        .where(User.id.in_([r.id for r in readers]), ~reviewed)
+        .order_by(Book.id, User.id)
+        .limit(limit)
+    )
+    return [((user_id, login, READER_PASSWORD), book_id) for user_id, login, book_id in rows]
+
+def context(requests):
+    book_ids = db.session.scalars(select(Book.id).limit(10000)).all()
+    readers = db.session.execute(
+        select(User.id, User.login).where(User.login.like('reader%')).order_by(User.id).limit(REVIEWERS)
+    ).all()
+    admin = db.session.scalar(select(User.id).where(User.login == ADMIN[0]))
+    pairs = review_pairs(readers, requests)
+    db.session.remove()
+    return {
+        'book_ids':     book_ids,
+        'pages':        max(1, min(50, len(book_ids) // 10)),
+        'review_pairs': pairs,
+        'users':        {'reader': (readers[0].id, readers[0].login, READER_PASSWORD) if readers else None,
+                         'admin':  (admin, *ADMIN) if admin else None},
+        'export_from':  time.strftime('%Y-%m-%d', time.localtime(time.time() - 7 * 86400)),
+    }
+
+def summarize(samples, elapsed, queries=None, errors=0):
+    samples = sorted(samples)
+    if not samples:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(samples),
+        'errors':   errors,
+        'p50_ms':   statistics.median(samples) * 1000,
+        'p99_ms':   samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'rps':      len(samples) / elapsed if elapsed else 0,
+        'queries':  statistics.mean(queries) if queries else None,
+    }
+
+def run_client(scenario, ctx, requests):
+    skipped = scenario.skipped(ctx)
+    if skipped:
+        return {'requests': 0, 'errors': 0, 'skipped': skipped}
+    rnd = random.Random(1)
+    client = app.test_client()
+    if scenario.login:
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(ctx['users'][scenario.login][0])
+    samples, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        user, url, data = scenario.pick(rnd, ctx)
+        if user is not None:
+            with client.session_transaction() as sess:
+                sess['_user_id'] = str(user[0])
+        t0 = time.perf_counter()
+        with app.app_context(), count_queries(*db.engines.values()) as statements:
+            resp = client.open(url, method=scenario.method, data=data)
+            resp.get_data()
+        samples.append(time.perf_counter() - t0)
+        queries.append(len(statements))
+        errors += resp.status_code >= 400
+    return summarize(samples, time.perf_counter() - started, queries, errors)
+
+def http_opener(base_url, user):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    if user:
+        body = urllib.parse.urlencode({'login': user[1], 'password': user[2]}).encode()
+        opener.open(base_url + '/auth/login', body).read()
+    return opener
+
+def run_http(scenario, ctx, requests, base_url, concurrency):
+    skipped = scenario.skipped(ctx)
+    if skipped:
+        return {'requests': 0, 'errors': 0, 'skipped': skipped}
+    samples, errors = [], [0]
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        default = http_opener(base_url, ctx['users'].get(scenario.login) if scenario.login else None)
+        openers = {}
+        for _ in range(per_thread):
+            user, url, data = scenario.pick(rnd, ctx)
+            if user is None:
+                opener = default
+            else:
+                if user[1] not in openers:
+                    openers[user[1]] = http_opener(base_url, user)
+                opener = openers[user[1]]
+            body = urllib.parse.urlencode(data).encode() if data else None
+            t0 = time.perf_counter()
+            try:
+                with opener.open(base_url + url, body) as resp:
+                    resp.read()
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                samples.append(time.perf_counter() - t0)
+                errors[0] += not ok
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.perf_counter() - started, errors=errors[0])
+
+def start_server(port, workers, serving):
+    if serving == 'async':
+        cmd = [sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--port', str(port),
+               '--log-level', 'warning', 'asgi:asgi_app']
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app']
+    proc = subprocess.Popen(
+        cmd,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, SERVING_MODE=serving),
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(50):
+        try:
+            urllib.request.urlopen(base_url + '/auth/login').read()
+            return proc, base_url
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit('сервер не запустился')
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base or not res.get('requests') or not base.get('requests'):
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if res[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{name}.{metric}: {base[metric]:.1f} → {res[metric]:.1f}")
+        if res.get('queries') and base.get('queries') and res['queries'] > base['queries']:
+            regressions.append(f"{name}.queries: {base['queries']:.1f} → {res['queries']:.1f}")
+    return regressions
+
+def report(results):
+    print(f"{'сценарий':<14} {'запросов':>9} {'ошибок':>7} {'p50, мс':>9} {'p99, мс':>9} {'rps':>8} "
+          f"{'rps/вкр':>8} {'SQL':>6}")
+    for name, res in results.items():
+        if not res.get('requests'):
+            print(f"{name:<14} {res.get('skipped', 'нет данных')}")
+            continue
+        queries = f"{res['queries']:.1f}" if res.get('queries') is not None else '-'
+        per_worker = f"{res['rps_per_worker']:.1f}" if res.get('rps_per_worker') else '-'
+        print(f"{name:<14} {res['requests']:>9} {res['errors']:>7} {res['p50_ms']:>9.1f} "
+              f"{res['p99_ms']:>9.1f} {res['rps']:>8.1f} {per_worker:>8} {queries:>6}")
+
+def side_by_side(mode):
+    paths = {s: os.path.join(RESULTS_DIR, f"{mode if s == 'sync' else f'{mode}-{s}'}-latest.json")
+             for s in ('sync', 'async')}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return
+    runs = {}
+    for serving, path in paths.items():
+        with open(path, encoding='utf-8') as f:
+            runs[serving] = json.load(f)
+    print(f"\n{'сценарий':<14} {'sync rps/вкр':>13} {'async rps/вкр':>14} {'sync p99':>9} {'async p99':>10}")
+    for name in runs['sync']:
+        a, b = runs['sync'][name], runs['async'].get(name, {})
+        if not a.get('rps_per_worker') or not b.get('rps_per_worker'):
+            continue
+        print(f"{name:<14} {a['rps_per_worker']:>13.1f} {b['rps_per_worker']:>14.1f} "
+              f"{a['p99_ms']:>9.1f} {b['p99_ms']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование библиотеки.')
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--serving', choices=['sync', 'async'], default='sync',
+                        help='Режим сервера для --mode http: gunicorn (sync) или uvicorn (async).')
+    parser.add_argument('--url', help='Адрес уже запущенного сервера вместо запуска своего.')
+    parser.add_argument('--only', nargs='*', help='Запустить только указанные сценарии.')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with app.app_context():
+        ctx = context(args.requests)
+    scenarios = [s for s in SCENARIOS if not args.only or s.name in args.only]
+
+    results, proc = {}, None
+    try:
+        if args.mode == 'http':
+            base_url = args.url
+            if not base_url:
+                proc, base_url = start_server(args.port, args.workers, args.serving)
+            for s in scenarios:
+                results[s.name] = run_http(s, ctx, args.requests, base_url, args.concurrency)
+                if results[s.name].get('rps') and not args.url:
+                    results[s.name]['rps_per_worker'] = results[s.name]['rps'] / args.workers
+        else:
+            for s in scenarios:
+                results[s.name] = run_client(s, ctx, args.requests)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    report(results)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    label = args.mode if args.serving == 'sync' else f'{args.mode}-{args.serving}'
+    latest = os.path.join(RESULTS_DIR, f'{label}-latest.json')
+    baseline_path = os.path.join(RESULTS_DIR, f'{label}-baseline.json')
+    with open(latest, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.mode == 'http':
+        side_by_side(args.mode)
+    if args.save_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Базовые результаты сохранены в {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from recommend import np, aggregate, covisits, merge_top, write_matrix, NeighbourMatrix
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_results')
+
+def day_visits(rng, ranking, visits, basket):
+    visitors = rng.integers(0, max(1, visits // basket), visits)
+    popular = np.minimum(rng.zipf(1.3, visits), len(ranking)) - 1
+    return visitors, ranking[popular]
+
+def build(args, rng, path):
+    per_day = args.visits // args.days
+    timings = {'covisits': 0.0, 'merge': 0.0, 'write': 0.0}
+    ranking = rng.permutation(args.books) + 1
+    ids = counts = None
+    for start in range(0, args.days, args.merge_days):
+        found = []
+        for _ in range(min(args.merge_days, args.days - start)):
+            visitors, books = day_visits(rng, ranking, per_day, args.basket)
+            started = time.perf_counter()
+            pairs = covisits(visitors, books, args.basket_limit)
+            timings['covisits'] += time.perf_counter() - started
+            if pairs is not None:
+                found.append(pairs)
+        started = time.perf_counter()
+        pairs = aggregate(*(np.concatenate(col) for col in zip(*found))) if found else None
+        ids, counts = merge_top(ids, counts, pairs, args.candidates)
+        timings['merge'] += time.perf_counter() - started
+        print(f"  дни {start + 1}–{min(start + args.merge_days, args.days)}: "
+              f"{timings['covisits'] + timings['merge']:.1f} с", file=sys.stderr)
+    started = time.perf_counter()
+    write_matrix(path, ids, counts, ids.shape[0], args.candidates, date.today() - timedelta(days=1))
+    timings['write'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    visitors, books = day_visits(rng, ranking, per_day, args.basket)
+    ids, counts = merge_top(ids, counts, covisits(visitors, books, args.basket_limit), args.candidates)
+    timings['incremental_day'] = time.perf_counter() - started
+    return timings, int(np.count_nonzero(ids))
+
+def lookups(path, books, k, n):
+    matrix = NeighbourMatrix(path)
+    rnd = random.Random(1)
+    samples = []
+    for _ in range(n):
+        book_id = rnd.randint(1, books)
+        started = time.perf_counter()
+        matrix.neighbours(book_id, k)
+        samples.append((time.perf_counter() - started) * 1e6)
+    matrix.close()
+    samples.sort()
+    return {
+        'p50_us': round(statistics.median(samples), 2),
+        'p99_us': round(samples[int(len(samples) * 0.99) - 1], 2),
+        'max_us': round(samples[-1], 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер сборки матрицы совместных просмотров и поиска соседей.')
+    parser.add_argument('--books', type=int, default=1_000_000)
+    parser.add_argument('--visits', type=int, default=100_000_000)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--basket', type=int, default=3, help='Средний размер корзины посетителя за день.')
+    parser.add_argument('--basket-limit', type=int, default=30)
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--merge-days', type=int, default=30)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if np is None:
+        parser.error('для замера нужен NumPy')
+
+    rng = np.random.default_rng(args.seed)
+    fd, path = tempfile.mkstemp(suffix='.bin')
+    os.close(fd)
+    try:
+        timings, filled = build(args, rng, path)
+        results = {
+            'books':       args.books,
+            'visits':      args.visits,
+            'days':        args.days,
+            'candidates':  args.candidates,
+            'build_s':     round(timings['covisits'] + timings['merge'] + timings['write'], 2),
+            'stages_s':    {name: round(value, 2) for name, value in timings.items()},
+            'neighbours':  filled,
+            'file_mb':     round(os.path.getsize(path) / 2 ** 20, 1),
+            'lookup':      lookups(path, args.books, args.k, args.lookups),
+        }
+    finally:
+        os.remove(path)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'recommend-latest.json'), 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import random
+import statistics
+import time
+from app import app
+from models import db, Book
+from queries import CATALOGUE_OPTIONS, search_page
+from search import search_index
+from gen_data import gen_books
+
+TERMS = ['война', 'сад', 'мастер маргарита', 'золотой телёнок', 'эксмо', 'сердце']
+
+def generate(total, seed=1):
+    missing = total - db.session.query(Book.id).count()
+    if missing > 0:
+        gen_books(random.Random(seed), missing)
+
+def ilike_page(term, per_page=10):
+    return Book.query.options(*CATALOGUE_OPTIONS) \
+        .filter(Book.title.ilike(f'%{term}%')) \
+        .order_by(Book.year.desc(), Book.id.desc()) \
+        .paginate(page=1, per_page=per_page, error_out=False)
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+def run(books, repeat):
+    generate(books)
+    search_index.rebuild()
+    print(f"{'запрос':<20} {'ILIKE p50':>10} {'ILIKE p99':>10} {'FTS p50':>10} {'FTS p99':>10}")
+    for term in TERMS:
+        ilike = timed(lambda: ilike_page(term).items, repeat)
+        fts   = timed(lambda: search_page(1, term).items, repeat)
+        print(f"{term:<20} {ilike[0]:>10.2f} {ilike[1]:>10.2f} {fts[0]:>10.2f} {fts[1]:>10.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение ILIKE и полнотекстового поиска (мс).')
+    parser.add_argument('--books', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    with app.app_context():
+        db.create_all()
+        run(args.books, args.repeat)
@@ -1,34 +1,29 @@
-from flask import Blueprint, render_template, request, redirect, session, url_for, flash, current_app, send_from_directory
+from flask import Blueprint, render_template, request, redirect, session, url_for, flash, current_app, send_from_directory, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import func
 from werkzeug.utils import secure_filename
-from models import Visit, db, Book, Genre, Cover, Review, login_manager
+from models import db, Book, Genre, Cover, Review, login_manager
+from visits import visit_recorder
+from queries import catalogue_summary, catalogue_keyset, book_refs, book_for_detail, reviews_page, own_review_select
+from leaderboard import leaderboard
+from recommend import recommender
+from cache import result_cache
+from markup import stored_html
+from search import search_index
+from covers import spool_upload, check_image, commit_upload, discard_upload, hashed_path, remove_cover_files, InvalidCover
 from werkzeug.datastructures import MultiDict
-from datetime import date, datetime, timedelta
+from uuid import uuid4
 import os
-import hashlib
-import markdown
-import bleach
 
 main = Blueprint('main', __name__, template_folder='templates')
 
 ALLOWED_EXT = {'png','jpg','jpeg','gif'}
-BLEACH_TAGS = bleach.sanitizer.ALLOWED_TAGS.union({
-    'p','pre','code','h1','h2','h3','ul','ol','li','blockquote','img'
-})
-
-BLEACH_ATTRS = {
-    **bleach.sanitizer.ALLOWED_ATTRIBUTES,
-    'img': ['src','alt','title']
-}
+IMPORT_FORMATS = {'csv', 'jsonl', 'json'}
+COVER_MAX_AGE = 365 * 24 * 3600
+RECENT_LIMIT = 5
 
 def file_allow(fn):
     return '.' in fn and fn.rsplit('.',1)[1].lower() in ALLOWED_EXT
 
-def render_md(md_text):
-    html = markdown.markdown(md_text)
-    return bleach.clean(html, tags=BLEACH_TAGS, attributes=BLEACH_ATTRS)
-
 def check_role(*roles):
     from functools import wraps
     def deco(f):
@@ -36,110 +31,100 @@ def check_role(*roles):
         def wrapper(*args, **kw):
             if not current_user.is_authenticated:
                 return login_manager.unauthorized()
-            if current_user.role.name not in roles:
+            if current_user.role_name not in roles:
                 flash('У вас недостаточно прав для выполнения данного действия.', 'warning')
                 return redirect(url_for('main.index'))
             return f(*args, **kw)
         return wrapper
     return deco
 
-def visits_cnt(book_id, session_id, user_id, max_per_day=10):
-    today = date.today()
-    visits_today_q = Visit.query.filter_by(
-        book_id=book_id,
-        session_id=session_id
-    ).filter(func.date(Visit.timestamp) == today)
-    print('a')
-    print(user_id)
-    if user_id:
-        visits_today_q = visits_today_q.filter(Visit.user_id == user_id)
-
-    if visits_today_q.count() < max_per_day:
-        visit = Visit(book_id=book_id, session_id=session_id,user_id=user_id)
-        db.session.add(visit)
-        db.session.commit()
-
-def cover_save(file, book):
-    data = file.read()
-    checksum = hashlib.md5(data).hexdigest()
+def visits_cnt(book_id, session_id, user_id):
+    recorded = visit_recorder.record(book_id, session_id, user_id)
+    if recorded:
+        leaderboard.add(book_id, authenticated=user_id is not None)
+    return recorded
+
+def recent_push(book_id):
+    ring = [book_id] + [b for b in session.get('recent_books', []) if b != book_id]
+    session['recent_books'] = ring[:RECENT_LIMIT]
+
+def rating_apply(book_id, rating):
+    Book.query.filter_by(id=book_id).update({
+        Book.review_count: Book.review_count + 1,
+        Book.rating_sum:   Book.rating_sum + rating,
+    }, synchronize_session=False)
+
+def cover_save(file, book_id):
+    folder = current_app.config['UPLOAD_FOLDER']
+    tmp, checksum = spool_upload(file, folder)
+    try:
+        check_image(tmp)
+    except InvalidCover:
+        discard_upload(tmp)
+        raise
     existing = Cover.query.filter_by(md5_hash=checksum).first()
     if existing:
-        existing.book_id = book.id
+        discard_upload(tmp)
+        existing.book_id = book_id
     else:
         ext = secure_filename(file.filename).rsplit('.', 1)[1]
-        cover = Cover(filename='', mime_type=file.mimetype,
-                      md5_hash=checksum, book_id=book.id)
-        db.session.add(cover)
-        db.session.flush()
-        fname = f"{cover.id}.{ext}"
-        path = os.path.join(current_app.config['UPLOAD_FOLDER'], fname)
-        with open(path, 'wb') as f:
-            f.write(data)
-        cover.filename = fname
+        fname = hashed_path(checksum, ext)
+        commit_upload(tmp, folder, fname)
+        db.session.add(Cover(filename=fname, mime_type=file.mimetype,
+                             md5_hash=checksum, book_id=book_id))
 
 @main.route('/', methods=['GET'])
 @main.route('/page/<int:page>', methods=['GET'])
 def index(page=1):
     search_term = request.args.get('q', '').strip()
+    if not search_term and current_app.config['CATALOGUE_PAGINATION'] == 'keyset':
+        after, before = request.args.get('after'), request.args.get('before')
+        paginated = result_cache.get_or_set(
+            'catalogue', f'keyset:{after}:{before}',
+            lambda: catalogue_keyset(after, before),
+            ttl=current_app.config['CACHE_CATALOGUE_TTL'],
+        )
+    else:
+        paginated = result_cache.get_or_set(
+            'catalogue', f'{page}:{search_term}',
+            lambda: catalogue_summary(page, search_term),
+            ttl=current_app.config['CACHE_CATALOGUE_TTL'],
+        )
 
-    books_q = Book.query
-    if search_term:
-        books_q = books_q.filter(Book.title.ilike(f'%{search_term}%'))
-
-    paginated = books_q \
-        .order_by(Book.year.desc()) \
-        .paginate(page=page, per_page=10, error_out=False)
-
-    three_months_ago = datetime.now() - timedelta(days=90)
-    popular = (
-        db.session.query(Book, func.count(Visit.id).label('views'))
-        .join(Visit)
-        .filter(Visit.timestamp >= three_months_ago)
-        .group_by(Book.id)
-        .order_by(func.count(Visit.id).desc())
-        .limit(5)
-        .all()
-    )
-
-    visitor_id = session.get('visitor_id')
-    user_id    = current_user.get_id()
-    recent_q = Visit.query.filter(Visit.session_id == visitor_id)
-    if user_id:
-        recent_q = recent_q.filter(Visit.user_id == user_id)
-
-    recent_records = recent_q \
-        .order_by(Visit.timestamp.desc()) \
-        .limit(20) \
-        .all()
+    popular = leaderboard.top()
 
-    seen_books = set()
-    recent_books = []
-    for rec in recent_records:
-        if rec.book_id not in seen_books:
-            recent_books.append(rec.book)
-            seen_books.add(rec.book_id)
-        if len(recent_books) >= 5:
-            break
+    recent = book_refs(session.get('recent_books'))
 
-    return render_template('index.html', pagination=paginated, q=search_term, popular=popular, recent=recent_books)
+    return render_template('index.html', pagination=paginated, q=search_term, popular=popular, recent=recent)
 
-@main.route('/books/<int:book_id>', methods=['GET'])
-def book_detail(book_id):
-    book = Book.query.get_or_404(book_id)
+def book_page(book, reviews, user_review, similar):
+    rendered_desc = stored_html(book, 'description')
+    page_html = render_template(
+        'book_detail.html', book=book, book_html=rendered_desc,
+        reviews=reviews, existing_review=user_review, similar=similar,
+    )
 
     visitor_sid = session['visitor_id']
     user_uid = current_user.get_id()
     visits_cnt(book.id, visitor_sid, user_uid)
+    recent_push(book.id)
+    return page_html
 
-    rendered_desc = render_md(book.description)
+@main.route('/books/<int:book_id>', methods=['GET'])
+def book_detail(book_id):
+    book = book_for_detail(book_id)
     user_review = None
     if current_user.is_authenticated:
-        user_review = Review.query.filter_by(
-            book_id=book.id,
-            user_id=current_user.id
-        ).first()
+        user_review = db.session.scalar(own_review_select(book.id, current_user.id))
+    return book_page(book, reviews_page(book.id), user_review, book_refs(recommender.similar(book.id)))
 
-    return render_template('book_detail.html', book=book, book_html=rendered_desc, existing_review=user_review)
+@main.route('/books/<int:book_id>/reviews', methods=['GET'])
+def book_reviews(book_id):
+    reviews = reviews_page(book_id, request.args.get('after'))
+    html = render_template('reviews_list.html', book_id=book_id, reviews=reviews)
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        return jsonify(html=html, next=reviews.next_cursor)
+    return html
 
 @main.route('/books/<int:book_id>/review', methods=['GET','POST'])
 @login_required
@@ -158,7 +143,9 @@ def book_review(book_id):
                 text=text
             )
             db.session.add(review)
+            rating_apply(book.id, rating)
             db.session.commit()
+            result_cache.invalidate('catalogue')
             flash('Рецензия успешно сохранена.', 'success')
             return redirect(url_for('main.book_detail', book_id=book.id))
         except Exception:
@@ -176,12 +163,12 @@ def upsert_book(book_id=None):
         return redirect(url_for('auth.login', next=request.path))
 
     if is_edit:
-        if current_user.role.name not in ('admin', 'moderator'):
+        if current_user.role_name not in ('admin', 'moderator'):
             flash('Недостаточно прав для редактирования', 'danger')
             return redirect(url_for('main.index'))
         book = Book.query.get_or_404(book_id)
     else:
-        if current_user.role.name != 'admin':
+        if current_user.role_name != 'admin':
             flash('Недостаточно прав для создания', 'danger')
             return redirect(url_for('main.index'))
         book = None
@@ -221,19 +208,23 @@ def upsert_book(book_id=None):
             db.session.flush()
             file = request.files.get('cover')
             if file and file_allow(file.filename):
-                cover_save(file, book)
+                cover_save(file, book.id)
 
             db.session.commit()
+            search_index.update(book)
+            leaderboard.update_book(book.id, book.title, [g.id for g in book.genres])
+            result_cache.invalidate('catalogue')
             flash(
                 f'Книга успешно {"обновлена" if is_edit else "добавлена"}.',
                 'success'
             )
             return redirect(url_for('main.book_detail', book_id=book.id))
 
-        except Exception:
+        except Exception as exc:
             db.session.rollback()
             flash(
-                f'Ошибка при {"обновлении" if is_edit else "сохранении"} книги.',
+                f'Обложка не принята: {exc}.' if isinstance(exc, InvalidCover)
+                else f'Ошибка при {"обновлении" if is_edit else "сохранении"} книги.',
                 'danger'
             )
             return render_template('form_books.html', action=('edit' if is_edit else 'create'), genres=all_genres, book=book, form=request.form, errors=errors)
@@ -250,15 +241,16 @@ def upsert_book(book_id=None):
 @check_role('admin')
 def book_delete(book_id):
     book = Book.query.get_or_404(book_id)
-    cover_path = None
-    if book.cover:
-        cover_path = os.path.join(current_app.config['UPLOAD_FOLDER'], book.cover.filename)
+    cover_file = book.cover.filename if book.cover else None
 
     try:
         db.session.delete(book)
         db.session.commit()
-        if cover_path and os.path.exists(cover_path):
-            os.remove(cover_path)
+        search_index.remove(book_id)
+        leaderboard.remove_book(book_id)
+        result_cache.invalidate('catalogue')
+        if cover_file:
+            remove_cover_files(current_app.config['UPLOAD_FOLDER'], cover_file)
         flash('Книга успешно удалена.', 'success')
     except Exception:
         db.session.rollback()
@@ -266,6 +258,35 @@ def book_delete(book_id):
 
     return redirect(url_for('main.index'))
 
-@main.route('/covers/<filename>')
+@main.route('/books/import', methods=['GET', 'POST'])
+@check_role('admin')
+def book_import():
+    from jobs import job_queue
+    if request.method == 'POST':
+        file = request.files.get('file')
+        fmt = (file.filename.rsplit('.', 1)[-1].lower() if file and '.' in file.filename else '')
+        if fmt not in IMPORT_FORMATS:
+            flash('Загрузите файл CSV или JSONL', 'danger')
+            return render_template('book_import.html')
+        folder = os.path.join(job_queue.folder, 'uploads')
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'{uuid4().hex}.{fmt}')
+        file.save(path)
+        job, _ = job_queue.enqueue('book_import', {
+            'path':       path,
+            'format':     'csv' if fmt == 'csv' else 'jsonl',
+            'covers_dir': current_app.config['IMPORT_COVERS_FOLDER'],
+        }, current_user.id)
+        flash(f'Импорт поставлен в очередь (задача №{job.id}). Отчёт об ошибках появится в списке задач.', 'success')
+        return redirect(url_for('stats.stats_jobs'))
+    return render_template('book_import.html')
+
+@main.route('/covers/<path:filename>')
 def covers(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    resp = send_from_directory(
+        current_app.config['UPLOAD_FOLDER'], filename,
+        max_age=COVER_MAX_AGE, conditional=True, etag=True
+    )
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
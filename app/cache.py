@@ -0,0 +1,173 @@
+import abc
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+from sqlalchemy import insert, select, update
+from models import db, CacheGeneration
+
+class BaseCache(abc.ABC):
+    shared = False
+
+    @abc.abstractmethod
+    def get(self, key):
+        ...
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key):
+        ...
+
+    @abc.abstractmethod
+    def incr(self, key):
+        ...
+
+    @abc.abstractmethod
+    def counter(self, key):
+        ...
+
+class LRUCache(BaseCache):
+    def __init__(self, maxsize=1024):
+        self.maxsize   = maxsize
+        self._lock     = threading.Lock()
+        self._items    = OrderedDict()
+        self._counters = {}
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+class RedisCache(BaseCache):
+    shared = True
+
+    def __init__(self, client, prefix='library:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+class ResultCache:
+    def __init__(self, app=None, backend=None):
+        self.backend      = backend
+        self.metrics      = Counter()
+        self._generations = {}
+        if app is not None:
+            self.init_app(app)
+
+    # Set CACHE_REDIS_URL whenever more than one worker process serves the app.
+    # Without it every process keeps its own LRU, and an invalidation reaches the
+    # other processes only through cache_generations, up to CACHE_GENERATION_POLL
+    # seconds late; until then they keep serving the old pages.
+    def init_app(self, app, backend=None):
+        app.config.setdefault('CACHE_MAXSIZE', 1024)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+        app.config.setdefault('CACHE_CATALOGUE_TTL', 300)
+        app.config.setdefault('CACHE_GENERATION_POLL', 1.0)
+        self.poll = app.config['CACHE_GENERATION_POLL']
+        if backend is not None:
+            self.backend = backend
+        elif self.backend is None:
+            if app.config['CACHE_REDIS_URL']:
+                import redis
+                self.backend = RedisCache(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+            else:
+                self.backend = LRUCache(app.config['CACHE_MAXSIZE'])
+        app.extensions['result_cache'] = self
+
+    def generation(self, namespace):
+        if self.backend.shared:
+            return self.backend.counter('gen:' + namespace)
+        return self._stored_generation(namespace)
+
+    def _stored_generation(self, namespace, refresh=False):
+        now = time.monotonic()
+        checked, value = self._generations.get(namespace, (None, 0))
+        if refresh or checked is None or now - checked >= self.poll:
+            with db.engine.connect() as conn:
+                value = conn.scalar(
+                    select(CacheGeneration.value).where(CacheGeneration.namespace == namespace)
+                ) or 0
+            self._generations[namespace] = (now, value)
+        return value
+
+    def _lookup(self, namespace, key):
+        full_key = f"{namespace}:{self.generation(namespace)}:{key}"
+        value = self.backend.get(full_key)
+        self.metrics[f"{namespace}.{'miss' if value is None else 'hit'}"] += 1
+        return full_key, value
+
+    def get_or_set(self, namespace, key, producer, ttl=None):
+        full_key, value = self._lookup(namespace, key)
+        if value is None:
+            value = producer()
+            self.backend.set(full_key, value, ttl)
+        return value
+
+    async def aget_or_set(self, namespace, key, producer, ttl=None):
+        full_key, value = self._lookup(namespace, key)
+        if value is None:
+            value = await producer()
+            self.backend.set(full_key, value, ttl)
+        return value
+
+    def invalidate(self, namespace):
+        if self.backend.shared:
+            self.backend.incr('gen:' + namespace)
+        else:
+            with db.engine.begin() as conn:
+                bumped = conn.execute(
+                    update(CacheGeneration)
+                    .where(CacheGeneration.namespace == namespace)
+                    .values(value=CacheGeneration.value + 1)
+                ).rowcount
+                if not bumped:
+                    conn.execute(insert(CacheGeneration).values(namespace=namespace, value=1))
+            self._stored_generation(namespace, refresh=True)
+        self.metrics[f'{namespace}.invalidate'] += 1
+
+result_cache = ResultCache()
@@ -0,0 +1,219 @@
+import click
+from datetime import date, timedelta
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, update
+from models import db, Book, Cover, Review, Visit
+from querycount import count_queries
+from rollups import compact_visits
+from markup import refresh_html
+from search import search_index
+from jobs import job_queue
+from importer import import_books, IMPORT_REPORT_HEADER
+from exports import csv_chunks
+from partitions import maintain_partitions
+from recommend import recommender
+from leaderboard import leaderboard
+
+QUERY_BUDGETS = {
+    'main.index':       5,
+    'main.book_detail': 4,
+}
+IDENTITY_QUERIES = 1
+AUTHENTICATED_QUERIES = {'main.book_detail': 1}
+
+def recompute_ratings():
+    review_count = (select(func.count(Review.id))
+        .where(Review.book_id == Book.id)
+        .scalar_subquery())
+    rating_sum = (select(func.coalesce(func.sum(Review.rating), 0))
+        .where(Review.book_id == Book.id)
+        .scalar_subquery())
+    res = db.session.execute(
+        update(Book).values(review_count=review_count, rating_sum=rating_sum)
+    )
+    db.session.commit()
+    return res.rowcount
+
+@click.command('rebuild-ratings')
+@with_appcontext
+def rebuild_ratings():
+    click.echo(f"Рейтинги пересчитаны для {recompute_ratings()} книг.")
+
+@click.command('check-queries')
+@click.option('--user-id', type=int, help='Выполнить запросы от имени пользователя.')
+@with_appcontext
+def check_queries(user_id):
+    book_ids = [row.id for row in db.session.query(Book.id).order_by(Book.id).limit(2)]
+    routes = [
+        ('main.index',       '/'),
+        ('main.index',       '/page/2'),
+        ('main.index',       '/?q=а'),
+    ] + [('main.book_detail', f'/books/{bid}') for bid in book_ids]
+    db.session.remove()
+    leaderboard.top()
+
+    client = current_app.test_client()
+    if user_id:
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+
+    failed = False
+    for endpoint, url in routes:
+        with count_queries(*db.engines.values()) as statements:
+            resp = client.get(url)
+        budget = QUERY_BUDGETS[endpoint] + (IDENTITY_QUERIES + AUTHENTICATED_QUERIES.get(endpoint, 0) if user_id else 0)
+        ok = resp.status_code == 200 and len(statements) <= budget
+        failed |= not ok
+        click.echo(f"{'OK  ' if ok else 'FAIL'} {url}: {len(statements)} запросов (лимит {budget}), HTTP {resp.status_code}")
+        if not ok:
+            for stmt in statements:
+                click.echo('    ' + ' '.join(stmt.split())[:200])
+    if failed:
+        raise SystemExit(1)
+
+def access_paths():
+    week_ago = date.today() - timedelta(days=7)
+    return [
+        ('каталог по году', ('ix_books_year_id',),
+         select(Book.id).order_by(Book.year.desc(), Book.id.desc()).limit(10)),
+        ('просмотры за период', ('ix_visits_visit_date_book',),
+         select(Visit.book_id, func.count(Visit.id))
+         .where(Visit.visit_date >= week_ago)
+         .group_by(Visit.book_id)),
+        ('журнал посещений', ('ix_visits_timestamp_id',),
+         select(Visit.id)
+         .where(Visit.timestamp >= week_ago)
+         .order_by(Visit.timestamp.desc(), Visit.id.desc())
+         .limit(10)),
+        ('рецензия пользователя', ('uq_reviews_book_user', 'sqlite_autoindex_reviews_1'),
+         select(Review.id).where(Review.book_id == 1, Review.user_id == 1)),
+        ('обложка книги', ('ix_covers_book_id',),
+         select(Cover.id).where(Cover.book_id.in_([1, 2]))),
+    ]
+
+def explain(conn, stmt):
+    sql = str(stmt.compile(conn, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        return '\n'.join(row[0] for row in conn.exec_driver_sql('EXPLAIN ' + sql))
+    return '\n'.join(str(row[-1]) for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql))
+
+@click.command('explain-check')
+@with_appcontext
+def explain_check():
+    failed = False
+    with db.engine.connect() as conn:
+        for name, indexes, stmt in access_paths():
+            with conn.begin():
+                plan = explain(conn, stmt)
+            ok = any(ix in plan for ix in indexes)
+            failed |= not ok
+            click.echo(f"{'OK  ' if ok else 'FAIL'} {name}: ожидается {indexes[0]}")
+            if not ok:
+                for line in plan.splitlines():
+                    click.echo('    ' + line)
+    if failed:
+        raise SystemExit(1)
+
+@click.command('rollup-visits')
+@click.option('--full', is_flag=True, help='Пересчитать сводку за всё время.')
+@with_appcontext
+def rollup_visits(full):
+    rows = compact_visits(full=full)
+    click.echo(f"Сводка просмотров обновлена: {rows} строк.")
+
+@click.command('render-markdown')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def render_markdown(batch_size):
+    for model, field in ((Book, 'description'), (Review, 'text')):
+        changed = 0
+        last_id = 0
+        while True:
+            batch = model.query \
+                .filter(model.id > last_id) \
+                .order_by(model.id) \
+                .limit(batch_size) \
+                .all()
+            if not batch:
+                break
+            changed += sum(refresh_html(obj, field) for obj in batch)
+            last_id = batch[-1].id
+            db.session.commit()
+        click.echo(f"{model.__tablename__}: перерисовано {changed} записей.")
+
+@click.command('reindex-search')
+@with_appcontext
+def reindex_search():
+    search_index.rebuild()
+    click.echo("Поисковый индекс перестроен.")
+
+@click.command('jobs-cleanup')
+@with_appcontext
+def jobs_cleanup():
+    stale, expired = job_queue.cleanup()
+    click.echo(f"Зависших задач: {stale}, удалено устаревших: {expired}.")
+
+@click.command('jobs-worker')
+@with_appcontext
+def jobs_worker():
+    click.echo(f"Обработчик фоновых задач запущен, процессов: {job_queue.workers}.")
+    try:
+        job_queue.serve()
+    except KeyboardInterrupt:
+        click.echo("Обработчик остановлен.")
+
+@click.command('import-books')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='По умолчанию определяется по расширению файла.')
+@click.option('--covers-dir', type=click.Path(exists=True, file_okay=False), help='Каталог с файлами обложек.')
+@click.option('--chunk-size', default=1000, show_default=True)
+@click.option('--errors', 'errors_file', type=click.File('wb'), help='Сохранить отчёт об ошибках в CSV.')
+@with_appcontext
+def import_books_command(file, fmt, covers_dir, chunk_size, errors_file):
+    fmt = fmt or ('csv' if file.name.lower().endswith('.csv') else 'jsonl')
+    report = import_books(file, fmt, covers_dir, chunk_size)
+    if errors_file:
+        for chunk in csv_chunks(IMPORT_REPORT_HEADER, report.errors):
+            errors_file.write(chunk)
+    for line, message in report.errors[:20]:
+        click.echo(f"Строка {line}: {message}", err=True)
+    click.echo(f"Добавлено книг: {report.inserted}, ошибок: {len(report.errors)}.")
+
+@click.command('visits-maintenance')
+@click.option('--ahead', type=int, help='Сколько месяцев вперёд держать готовые секции.')
+@click.option('--keep-months', type=int, help='Сколько месяцев хранить в базе до выгрузки в архив.')
+@with_appcontext
+def visits_maintenance(ahead, keep_months):
+    config = current_app.config
+    created, archived = maintain_partitions(
+        config['VISITS_PARTITIONS_AHEAD'] if ahead is None else ahead,
+        config['VISITS_RETENTION_MONTHS'] if keep_months is None else keep_months,
+    )
+    for month in created:
+        click.echo(f"Создана секция за {month:%m.%Y}.")
+    for month, rows in archived.items():
+        click.echo(f"Секция за {month:%m.%Y} выгружена в архив: {rows} просмотров.")
+    if not created and not archived:
+        click.echo("Изменений нет.")
+
+@click.command('build-recommendations')
+@click.option('--full', is_flag=True, help='Пересобрать матрицу с нуля, а не с последней отметки.')
+@with_appcontext
+def build_recommendations(full):
+    days, pairs = recommender.build(full=full)
+    click.echo(f"Рекомендации обновлены: обработано дней {days}, связей в матрице {pairs}.")
+
+def register_commands(app):
+    app.cli.add_command(rebuild_ratings)
+    app.cli.add_command(rollup_visits)
+    app.cli.add_command(render_markdown)
+    app.cli.add_command(reindex_search)
+    app.cli.add_command(check_queries)
+    app.cli.add_command(explain_check)
+    app.cli.add_command(jobs_cleanup)
+    app.cli.add_command(jobs_worker)
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(visits_maintenance)
+    app.cli.add_command(build_recommendations)
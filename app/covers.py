@@ -0,0 +1,88 @@
+import hashlib
+import os
+import tempfile
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+CHUNK_SIZE  = 64 * 1024
+THUMB_SIZES = {'sm': 96, 'md': 240, 'lg': 480}
+
+class InvalidCover(ValueError):
+    pass
+
+def hashed_path(checksum, ext):
+    return f"{checksum[:2]}/{checksum[2:4]}/{checksum}.{ext.lower()}"
+
+def thumb_ext():
+    if Image is not None and features.check('webp'):
+        return 'webp'
+    return 'jpg'
+
+def thumb_path(filename, size):
+    base = filename.rsplit('.', 1)[0]
+    return f"{base}_{size}.{thumb_ext()}"
+
+def spool_upload(file, folder):
+    digest = hashlib.md5()
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.upload')
+    with os.fdopen(fd, 'wb') as out:
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return tmp, digest.hexdigest()
+
+def check_image(path):
+    if Image is None:
+        return
+    try:
+        with Image.open(path) as img:
+            img.verify()
+    except Image.DecompressionBombError:
+        raise InvalidCover('изображение слишком большое')
+    except (OSError, SyntaxError, ValueError):
+        raise InvalidCover('файл не является изображением')
+
+def make_thumbnails(folder, filename):
+    if Image is None:
+        return []
+    made = []
+    ext = thumb_ext()
+    with Image.open(os.path.join(folder, filename)) as img:
+        if ext == 'jpg' or img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        for size, width in THUMB_SIZES.items():
+            thumb = img.copy()
+            thumb.thumbnail((width, width * 2))
+            name = thumb_path(filename, size)
+            thumb.save(os.path.join(folder, name), 'WEBP' if ext == 'webp' else 'JPEG', quality=85)
+            made.append(name)
+    return made
+
+def commit_upload(tmp, folder, filename):
+    target = os.path.join(folder, filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp, target)
+    try:
+        make_thumbnails(folder, filename)
+    except OSError:
+        pass
+
+def discard_upload(tmp):
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+def cover_variant(folder, filename, size):
+    name = thumb_path(filename, size)
+    return name if os.path.exists(os.path.join(folder, name)) else filename
+
+def remove_cover_files(folder, filename):
+    for name in [filename] + [thumb_path(filename, size) for size in THUMB_SIZES]:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,101 @@
+import csv
+import io
+from itertools import chain
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import select
+from models import db, Visit, Book, User
+from rollups import views_by_book
+from archive import visit_archive, to_micros, from_micros, NO_USER
+
+LOOKUP_BATCH = 500
+
+def parse_period(date_from, date_to):
+    return (
+        date.fromisoformat(date_from) if date_from else None,
+        date.fromisoformat(date_to) if date_to else None,
+    )
+
+def visit_log_query(date_from=None, date_to=None):
+    q = (
+        select(User.last_name, User.first_name, Book.title, Visit.timestamp)
+        .select_from(Visit)
+        .join(Book, Book.id == Visit.book_id)
+        .outerjoin(User, User.id == Visit.user_id)
+        .order_by(Visit.timestamp.desc(), Visit.id.desc())
+    )
+    if date_from:
+        q = q.where(Visit.timestamp >= datetime.combine(date_from, time.min))
+    if date_to:
+        q = q.where(Visit.timestamp < datetime.combine(date_to + timedelta(days=1), time.min))
+    return q
+
+def views_report_columns(views):
+    return Book.id.label('id'), Book.title.label('title'), views.c.cnt.label('cnt')
+
+def views_report(date_from, date_to):
+    date_from, date_to = parse_period(date_from, date_to)
+    views = views_by_book(date_from=date_from, date_to=date_to, authenticated_only=True)
+    return db.session.query(*views_report_columns(views)) \
+        .join(views, views.c.book_id == Book.id) \
+        .order_by(views.c.cnt.desc())
+
+def lookup(query, key, ids, batch_size=LOOKUP_BATCH):
+    ids, found = sorted(ids), {}
+    for i in range(0, len(ids), batch_size):
+        for row in db.session.execute(query.where(key.in_(ids[i:i + batch_size]))):
+            found[row[0]] = row[1:]
+    return found
+
+def archived_visit_log(date_from=None, date_to=None):
+    start = to_micros(datetime.combine(date_from, time.min)) if date_from else None
+    end   = to_micros(datetime.combine(date_to + timedelta(days=1), time.min)) if date_to else None
+    for month in reversed(visit_archive.months(date_from, date_to)):
+        with visit_archive.open(month) as part:
+            for stamps, books, users in part.blocks(('timestamp', 'book_id', 'user_id'), start, end, reverse=True):
+                titles = lookup(select(Book.id, Book.title), Book.id, set(books))
+                names = lookup(select(User.id, User.last_name, User.first_name), User.id, set(users) - {NO_USER})
+                for n in reversed(range(len(stamps))):
+                    ts = stamps[n]
+                    if (start is not None and ts < start) or (end is not None and ts >= end) or books[n] not in titles:
+                        continue
+                    yield (*names.get(users[n], (None, None)), *titles[books[n]], from_micros(ts))
+
+def visit_log_rows(date_from=None, date_to=None, batch_size=1000):
+    result = db.session.execute(
+        visit_log_query(date_from, date_to).execution_options(yield_per=batch_size)
+    )
+    rows = chain(result, archived_visit_log(date_from, date_to))
+    for i, (last_name, first_name, title, ts) in enumerate(rows, 1):
+        user = f"{last_name} {first_name}" if last_name is not None else "Неаутентифицированный"
+        yield [i, user, title, ts]
+
+def views_rows(query, batch_size=1000):
+    for i, (_, title, cnt) in enumerate(query.yield_per(batch_size), 1):
+        yield [i, title, cnt]
+
+def csv_chunks(header, rows, chunk_rows=1000):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')
+    writer.writerow(header)
+    for n, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if n % chunk_rows == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+VISIT_LOG_HEADER = ['№', 'Пользователь', 'Книга', 'Дата/Время']
+VIEWS_HEADER     = ['№', 'Книга', 'Просмотров']
+
+def visit_log_export(date_from=None, date_to=None):
+    return VISIT_LOG_HEADER, visit_log_rows(*parse_period(date_from, date_to))
+
+def views_export(date_from=None, date_to=None):
+    return VIEWS_HEADER, views_rows(views_report(date_from, date_to))
+
+EXPORTS = {
+    'visit_log': ('user_log',       'Журнал действий',      visit_log_export),
+    'views':     ('visits_actions', 'Статистика просмотров', views_export),
+}
@@ -0,0 +1,157 @@
+import argparse
+import csv
+import hashlib
+import io
+import random
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from werkzeug.security import generate_password_hash
+from app import app
+from models import db, Book, Cover, Genre, Review, Role, User, Visit, book_genre
+from create_db import seed
+from commands import recompute_ratings
+from rollups import compact_visits
+from search import search_index
+
+WORDS = [
+    'война', 'мир', 'преступление', 'наказание', 'идиот', 'мастер', 'маргарита',
+    'отцы', 'дети', 'мёртвые', 'души', 'капитанская', 'дочка', 'герой', 'времени',
+    'обломов', 'гроза', 'чайка', 'вишнёвый', 'сад', 'горе', 'ума', 'тихий', 'дон',
+    'белая', 'гвардия', 'собачье', 'сердце', 'двенадцать', 'стульев', 'золотой', 'телёнок',
+]
+PUBLISHERS = ['Эксмо', 'АСТ', 'Азбука', 'Просвещение', 'Наука', 'Речь']
+READER_PASSWORD = 'bench'
+SAMPLE_COVER = '1.jpg'
+
+def phrase(rnd, n):
+    return ' '.join(rnd.choice(WORDS) for _ in range(n))
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_insert(table, columns, rows, chunk=50000):
+    total = 0
+    for batch in chunked(rows, chunk):
+        if db.engine.dialect.name == 'postgresql':
+            buf = io.StringIO()
+            csv.writer(buf).writerows(batch)
+            buf.seek(0)
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf
+            )
+        else:
+            db.session.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+        db.session.commit()
+        total += len(batch)
+        print(f"{table.name}: {total}")
+    return total
+
+def new_ids(model, after):
+    return db.session.scalars(select(model.id).where(model.id > after).order_by(model.id)).all()
+
+def max_id(model):
+    return db.session.scalar(select(func.coalesce(func.max(model.id), 0)))
+
+def gen_users(rnd, count):
+    role_id = db.session.scalar(select(Role.id).where(Role.name == 'user'))
+    pwd_hash = generate_password_hash(READER_PASSWORD)
+    start = max_id(User)
+    rows = (
+        (f'reader{start + i}', pwd_hash, phrase(rnd, 1).title(), phrase(rnd, 1).title(), None, role_id)
+        for i in range(1, count + 1)
+    )
+    bulk_insert(User.__table__, ['login', 'password_hash', 'last_name', 'first_name', 'patronymic', 'role_id'], rows)
+    return new_ids(User, start)
+
+def gen_books(rnd, count):
+    start = max_id(Book)
+    rows = (
+        (phrase(rnd, 3).capitalize(), phrase(rnd, 40), rnd.randint(1800, 2024),
+         rnd.choice(PUBLISHERS), phrase(rnd, 2).title(), rnd.randint(50, 1200))
+        for _ in range(count)
+    )
+    bulk_insert(Book.__table__, ['title', 'description', 'year', 'publisher', 'author', 'pages'], rows)
+    return new_ids(Book, start)
+
+def gen_book_genres(rnd, book_ids):
+    genre_ids = db.session.scalars(select(Genre.id)).all()
+    rows = (
+        (book_id, genre_id)
+        for book_id in book_ids
+        for genre_id in rnd.sample(genre_ids, rnd.randint(1, min(2, len(genre_ids))))
+    )
+    bulk_insert(book_genre, ['book_id', 'genre_id'], rows)
+
+def gen_covers(rnd, book_ids, share):
+    rows = (
+        (SAMPLE_COVER, 'image/jpeg', hashlib.md5(f'bench-{book_id}'.encode()).hexdigest(), book_id)
+        for book_id in book_ids if rnd.random() < share
+    )
+    bulk_insert(Cover.__table__, ['filename', 'mime_type', 'md5_hash', 'book_id'], rows)
+
+def gen_reviews(rnd, book_ids, user_ids, per_book):
+    now = datetime.now()
+    rows = (
+        (book_id, user_id, rnd.randint(0, 5), phrase(rnd, rnd.randint(20, 200)),
+         now - timedelta(minutes=rnd.randint(0, 60 * 24 * 365)))
+        for book_id in book_ids
+        for user_id in rnd.sample(user_ids, min(len(user_ids), rnd.randint(0, per_book * 2)))
+    )
+    bulk_insert(Review.__table__, ['book_id', 'user_id', 'rating', 'text', 'created_at'], rows)
+
+def gen_visits(rnd, book_ids, user_ids, count, days):
+    now = datetime.now()
+    sessions = [uuid.uuid4().hex for _ in range(max(1, count // 20))]
+    last = len(book_ids) - 1
+
+    def row():
+        book_id = book_ids[min(last, int(rnd.paretovariate(1.2)) - 1)] if rnd.random() < 0.5 else rnd.choice(book_ids)
+        user_id = rnd.choice(user_ids) if user_ids and rnd.random() < 0.3 else None
+        ts = now - timedelta(seconds=rnd.randint(0, days * 86400))
+        return (user_id, rnd.choice(sessions), book_id, ts, ts.date())
+
+    bulk_insert(Visit.__table__, ['user_id', 'session_id', 'book_id', 'timestamp', 'visit_date'], (row() for _ in range(count)))
+
+def generate(books, users, reviews_per_book, visits, days=180, cover_share=0.3, seed_value=1):
+    rnd = random.Random(seed_value)
+    db.create_all()
+    seed()
+    user_ids = gen_users(rnd, users)
+    book_ids = gen_books(rnd, books)
+    gen_book_genres(rnd, book_ids)
+    gen_covers(rnd, book_ids, cover_share)
+    gen_reviews(rnd, book_ids, user_ids, reviews_per_book)
+    if book_ids:
+        gen_visits(rnd, book_ids, user_ids, visits, days)
+    print(f"Рейтинги пересчитаны: {recompute_ratings()}")
+    print(f"Сводка просмотров: {compact_visits(full=True)} строк")
+    search_index.rebuild()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Генерация синтетических данных библиотеки.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Множитель для всех объёмов.')
+    parser.add_argument('--books', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--reviews-per-book', type=int, default=5)
+    parser.add_argument('--visits', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    with app.app_context():
+        generate(
+            books=int(args.books * args.scale),
+            users=int(args.users * args.scale),
+            reviews_per_book=args.reviews_per_book,
+            visits=int(args.visits * args.scale),
+            days=args.days,
+            seed_value=args.seed,
+        )
@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+from flask import g, request, session
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response
+from cache import result_cache
+from leaderboard import leaderboard
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json', 'application/javascript'}
+
+class HttpCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('HTTP_CACHE_ENDPOINTS', ('main.index',))
+        app.config.setdefault('STATIC_MAX_AGE', 3600)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+        self.endpoints      = set(app.config['HTTP_CACHE_ENDPOINTS'])
+        self.static_max_age = app.config['STATIC_MAX_AGE']
+        self.min_size       = app.config['COMPRESS_MIN_SIZE']
+        self.gzip_level     = app.config['COMPRESS_GZIP_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        self.remember       = app.config.get('REMEMBER_COOKIE_NAME', 'remember_token')
+        app.before_request(self._revalidate)
+        app.after_request(self._finish)
+        app.extensions['http_cache'] = self
+
+    def cacheable(self):
+        return (
+            request.method in ('GET', 'HEAD')
+            and request.endpoint in self.endpoints
+            and '_user_id' not in session
+            and '_flashes' not in session
+            and self.remember not in request.cookies
+        )
+
+    def validator(self):
+        popular = [(ref.id, n) for ref, n in leaderboard.top()]
+        raw = f"{result_cache.generation('catalogue')}:{request.full_path}:{popular}:{session.get('recent_books', [])}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _revalidate(self):
+        if not self.cacheable():
+            return None
+        etag = g.http_etag = self.validator()
+        if is_resource_modified(request.environ, etag=etag):
+            return None
+        return Response(status=304)
+
+    def _finish(self, response):
+        if 'http_etag' in g and response.status_code in (200, 304):
+            response.set_etag(g.pop('http_etag'), weak=True)
+            response.make_conditional(request)
+            response.cache_control.private  = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+        elif request.endpoint == 'static' and response.status_code in (200, 304):
+            response.cache_control.no_cache = None
+            response.cache_control.public   = True
+            response.cache_control.max_age  = self.static_max_age
+        self._compress(response)
+        return response
+
+    def _compress(self, response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code != 200
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE
+                or response.content_length is not None and response.content_length < self.min_size):
+            return
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return
+        response.vary.add('Accept-Encoding')
+        if brotli is not None and request.accept_encodings['br']:
+            response.set_data(brotli.compress(data, quality=self.brotli_quality))
+            response.headers['Content-Encoding'] = 'br'
+        elif request.accept_encodings['gzip']:
+            response.set_data(gzip.compress(data, self.gzip_level))
+            response.headers['Content-Encoding'] = 'gzip'
+
+http_cache = HttpCache()
@@ -0,0 +1,60 @@
+from collections import namedtuple
+from flask_login import UserMixin
+from sqlalchemy import event
+from cache import LRUCache
+from models import db, login_manager, User, Role
+
+class Principal(namedtuple('Principal', 'id login last_name first_name patronymic role_name'), UserMixin):
+    __slots__ = ()
+
+class IdentityCache:
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self.ttl   = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_SIZE', 10000)
+        app.config.setdefault('IDENTITY_CACHE_TTL', 300)
+        self.cache = LRUCache(app.config['IDENTITY_CACHE_SIZE'])
+        self.ttl   = app.config['IDENTITY_CACHE_TTL']
+        app.extensions['identity_cache'] = self
+
+    def load(self, user_id):
+        principal = self.cache.get(user_id)
+        if principal is None:
+            row = (
+                db.session.query(
+                    User.id, User.login, User.last_name, User.first_name, User.patronymic, Role.name
+                )
+                .join(Role, Role.id == User.role_id)
+                .filter(User.id == user_id)
+                .first()
+            )
+            if row is None:
+                return None
+            principal = Principal(*row)
+            self.cache.set(user_id, principal, self.ttl)
+        return principal
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.cache = LRUCache(self.cache.maxsize)
+        else:
+            self.cache.delete(user_id)
+
+identity_cache = IdentityCache()
+
+@login_manager.user_loader
+def load_user(user_id):
+    return identity_cache.load(int(user_id))
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, user):
+    identity_cache.invalidate(user.id)
+
+@event.listens_for(Role, 'after_update')
+def role_changed(mapper, connection, role):
+    identity_cache.invalidate()
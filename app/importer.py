@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+import mimetypes
+import os
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import FileStorage
+from werkzeug.security import safe_join
+from models import db, Book, Genre, book_genre
+from markup import render_md, md_hash
+from books import cover_save, file_allow
+from leaderboard import leaderboard
+from search import search_index
+from cache import result_cache
+
+BOOK_FIELDS = ('title', 'description', 'year', 'publisher', 'author', 'pages')
+INT_FIELDS = ('year', 'pages')
+IMPORT_REPORT_HEADER = ['Строка', 'Ошибка']
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.errors   = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+def read_records(stream, fmt):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            yield line, 'Некорректный JSON'
+            continue
+        yield line, record if isinstance(record, dict) else 'Ожидается JSON-объект'
+
+def split_genres(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if value is not None and not isinstance(value, str):
+        raise ValueError('Поле genres должно быть строкой или списком')
+    return [v.strip() for v in (value or '').split(';') if v.strip()]
+
+def validate(record, genre_map):
+    values = {}
+    for field in BOOK_FIELDS:
+        value = record.get(field)
+        value = value.strip() if isinstance(value, str) else value
+        if value in (None, ''):
+            raise ValueError(f'Не заполнено поле {field}')
+        if field in INT_FIELDS:
+            try:
+                if isinstance(value, bool):
+                    raise TypeError(value)
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Поле {field} должно быть числом')
+        elif not isinstance(value, str):
+            raise ValueError(f'Поле {field} должно быть строкой')
+        elif len(value) > 255 and field != 'description':
+            raise ValueError(f'Поле {field} длиннее 255 символов')
+        values[field] = value
+    genre_ids = []
+    for name in split_genres(record.get('genres')):
+        if name.lower() not in genre_map:
+            raise ValueError(f'Неизвестный жанр «{name}»')
+        genre_ids.append(genre_map[name.lower()])
+    values['description_html'] = render_md(values['description'])
+    values['description_hash'] = md_hash(values['description'])
+    cover = record.get('cover') or None
+    if cover is not None and not isinstance(cover, str):
+        raise ValueError('Поле cover должно быть строкой')
+    cover = cover.strip() if cover else None
+    if cover and not file_allow(cover):
+        raise ValueError('Недопустимый формат обложки')
+    return values, sorted(set(genre_ids)), cover
+
+def attach_cover(covers_dir, name, book_id):
+    path = safe_join(covers_dir, name) if covers_dir else None
+    if path is None or not os.path.isfile(path):
+        raise ValueError(f'файл {name} не найден')
+    with open(path, 'rb') as f:
+        file = FileStorage(f, filename=os.path.basename(path),
+                           content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        cover_save(file, book_id)
+
+def insert_chunk(chunk, covers_dir, report):
+    try:
+        ids = db.session.scalars(
+            insert(Book).returning(Book.id, sort_by_parameter_order=True),
+            [values for _, values, _, _ in chunk],
+        ).all()
+        links = [
+            {'book_id': book_id, 'genre_id': genre_id}
+            for book_id, (_, _, genre_ids, _) in zip(ids, chunk)
+            for genre_id in genre_ids
+        ]
+        if links:
+            db.session.execute(insert(book_genre), links)
+        db.session.commit()
+    except SQLAlchemyError as exc:
+        db.session.rollback()
+        if len(chunk) > 1:
+            for row in chunk:
+                insert_chunk([row], covers_dir, report)
+            return
+        reason = str(getattr(exc, 'orig', exc)).splitlines()[0]
+        report.error(chunk[0][0], f'Ошибка базы данных: {reason}')
+        return
+    report.inserted += len(ids)
+
+    for book_id, (line, values, genre_ids, cover) in zip(ids, chunk):
+        leaderboard.update_book(book_id, values['title'], genre_ids)
+        if cover:
+            try:
+                attach_cover(covers_dir, cover, book_id)
+                db.session.commit()
+            except (OSError, ValueError, SQLAlchemyError) as exc:
+                db.session.rollback()
+                report.error(line, f'Обложка: {exc}')
+
+def import_books(stream, fmt, covers_dir=None, chunk_size=1000):
+    report = ImportReport()
+    genre_map = {name.lower(): genre_id for genre_id, name in db.session.execute(select(Genre.id, Genre.name))}
+    chunk = []
+    for line, record in read_records(stream, fmt):
+        if isinstance(record, str):
+            report.error(line, record)
+            continue
+        try:
+            chunk.append((line, *validate(record, genre_map)))
+        except ValueError as exc:
+            report.error(line, str(exc))
+        if len(chunk) >= chunk_size:
+            insert_chunk(chunk, covers_dir, report)
+            chunk = []
+    if chunk:
+        insert_chunk(chunk, covers_dir, report)
+    if report.inserted:
+        search_index.invalidate()
+        result_cache.invalidate('catalogue')
+    return report
+
+def import_job(path, format, covers_dir=None):
+    try:
+        with open(path, 'rb') as f:
+            report = import_books(f, format, covers_dir)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    rows = [[line, message] for line, message in report.errors]
+    rows.append(['', f'Добавлено книг: {report.inserted}, ошибок: {len(report.errors)}'])
+    return IMPORT_REPORT_HEADER, rows
+
+IMPORTS = {
+    'book_import': ('import_report', 'Импорт книг', import_job),
+}
@@ -0,0 +1,177 @@
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, text, update
+from models import db, Job
+from exports import EXPORTS, csv_chunks
+from importer import IMPORTS
+
+log = logging.getLogger(__name__)
+
+ACTIVE = ('pending', 'running')
+DISPATCH_LOCK = 0x6a6f6273
+JOB_KINDS = {**EXPORTS, **IMPORTS}
+
+def params_hash(kind, params):
+    return hashlib.sha1(f"{kind}:{json.dumps(params, sort_keys=True)}".encode('utf-8')).hexdigest()
+
+def run_job(job_id):
+    from app import app
+    with app.app_context():
+        job_queue.execute(job_id)
+
+class JobQueue:
+    def __init__(self, app=None):
+        self._executor = None
+        self._thread   = None
+        self._started  = threading.Lock()
+        self._stop     = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_WORKERS', 2)
+        app.config.setdefault('JOBS_FOLDER', os.path.join(app.instance_path, 'exports'))
+        app.config.setdefault('JOBS_RETENTION_HOURS', 24)
+        app.config.setdefault('JOBS_TIMEOUT', 3600)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+        app.config.setdefault('JOBS_EMBEDDED', False)
+        self.app           = app
+        self.workers       = app.config['JOBS_WORKERS']
+        self.folder        = app.config['JOBS_FOLDER']
+        self.retention     = timedelta(hours=app.config['JOBS_RETENTION_HOURS'])
+        self.timeout       = timedelta(seconds=app.config['JOBS_TIMEOUT'])
+        self.poll_interval = app.config['JOBS_POLL_INTERVAL']
+        self.embedded      = app.config['JOBS_EMBEDDED']
+        app.extensions['job_queue'] = self
+
+    def enqueue(self, kind, params, user_id=None):
+        digest = params_hash(kind, params)
+        job = Job.query \
+            .filter(Job.params_hash == digest, Job.status.in_(ACTIVE)) \
+            .order_by(Job.id) \
+            .first()
+        created = job is None
+        if created:
+            job = Job(kind=kind, params=json.dumps(params, sort_keys=True), params_hash=digest, user_id=user_id)
+            db.session.add(job)
+            db.session.commit()
+        self.ensure_worker()
+        return job, created
+
+    def execute(self, job_id):
+        job = db.session.get(Job, job_id)
+        prefix, _, export = JOB_KINDS[job.kind]
+        filename = f"{job.id}_{prefix}_{job.created_at:%Y-%m-%d}.csv.gz"
+        path = os.path.join(self.folder, filename)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            header, rows = export(**json.loads(job.params))
+            with gzip.open(path + '.part', 'wb') as out:
+                for chunk in csv_chunks(header, rows):
+                    out.write(chunk)
+            os.replace(path + '.part', path)
+            job.status, job.filename = 'done', filename
+        except Exception as exc:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.status, job.error = 'failed', str(exc) or exc.__class__.__name__
+            log.exception('Задача %d завершилась с ошибкой', job_id)
+            if os.path.exists(path + '.part'):
+                os.remove(path + '.part')
+        job.finished_at = datetime.now()
+        db.session.commit()
+
+    def path(self, job):
+        return os.path.join(self.folder, job.filename)
+
+    def cleanup(self):
+        now = datetime.now()
+        stale = Job.query.filter(Job.status == 'running', Job.started_at < now - self.timeout).all()
+        for job in stale:
+            job.status, job.error, job.finished_at = 'failed', 'Превышено время выполнения', now
+        expired = Job.query.filter(~Job.status.in_(ACTIVE), Job.finished_at < now - self.retention).all()
+        for job in expired:
+            if job.filename and os.path.exists(self.path(job)):
+                os.remove(self.path(job))
+            db.session.delete(job)
+        db.session.commit()
+        return len(stale), len(expired)
+
+    def ensure_worker(self):
+        if not self.embedded or self._thread is not None:
+            return
+        with self._started:
+            if self._thread is None:
+                self._start_executor()
+                self._thread = threading.Thread(target=self._run, name='job-dispatcher', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def serve(self):
+        self._start_executor()
+        try:
+            self._run()
+        finally:
+            self.stop()
+
+    def _start_executor(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def stop(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self):
+        last_cleanup = 0
+        while not self._stop.wait(self.poll_interval):
+            with self.app.app_context():
+                try:
+                    if time.monotonic() - last_cleanup > 60:
+                        self.cleanup()
+                        last_cleanup = time.monotonic()
+                    self._dispatch()
+                except Exception:
+                    db.session.rollback()
+                    log.exception('Ошибка диспетчера фоновых задач')
+
+    def _dispatch(self):
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': DISPATCH_LOCK})
+        running = db.session.scalar(select(func.count(Job.id)).where(Job.status == 'running'))
+        pending = select(Job.id) \
+            .where(Job.status == 'pending') \
+            .order_by(Job.created_at, Job.id) \
+            .limit(max(self.workers - running, 0))
+        claimed = db.session.scalars(
+            update(Job)
+            .where(Job.id.in_(pending.scalar_subquery()), Job.status == 'pending')
+            .values(status='running', started_at=datetime.now())
+            .returning(Job.id)
+        ).all()
+        db.session.commit()
+        for job_id in claimed:
+            future = self._executor.submit(run_job, job_id)
+            future.add_done_callback(lambda f, job_id=job_id: self._finished(job_id, f))
+
+    def _finished(self, job_id, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            if job is not None and job.status == 'running':
+                job.status, job.error, job.finished_at = 'failed', str(future.exception()), datetime.now()
+                db.session.commit()
+
+job_queue = JobQueue()
@@ -0,0 +1,91 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import DateTime, func, text, tuple_
+from models import db
+
+class KeysetPage:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items       = items
+        self.per_page    = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total       = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def encode_cursor(value, ident):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, ident]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, sort_col):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, ident = json.loads(raw)
+        if isinstance(sort_col.type, DateTime):
+            value = datetime.fromisoformat(value)
+        return value, int(ident)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+def keyset_query(query, sort_col, id_col, after=None, before=None, per_page=10):
+    after  = decode_cursor(after, sort_col)
+    before = decode_cursor(before, sort_col) if after is None else None
+    key = tuple_(sort_col, id_col)
+
+    if before is not None:
+        query = query.filter(key > tuple_(*before)).order_by(sort_col.asc(), id_col.asc())
+    else:
+        if after is not None:
+            query = query.filter(key < tuple_(*after))
+        query = query.order_by(sort_col.desc(), id_col.desc())
+    return query.limit(per_page + 1), after, before
+
+def keyset_result(rows, sort_col, id_col, after, before, per_page=10, total=None):
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+
+    def cursor_of(row):
+        return encode_cursor(getattr(row, sort_col.key), getattr(row, id_col.key))
+
+    return KeysetPage(
+        rows, per_page,
+        next_cursor=cursor_of(rows[-1]) if rows and has_next else None,
+        prev_cursor=cursor_of(rows[0]) if rows and has_prev else None,
+        total=total,
+    )
+
+def keyset_page(query, sort_col, id_col, after=None, before=None, per_page=10, total=None):
+    query, after, before = keyset_query(query, sort_col, id_col, after, before, per_page)
+    return keyset_result(query.all(), sort_col, id_col, after, before, per_page, total)
+
+RELTUPLES = text(
+    "SELECT CASE WHEN c.relkind = 'p' THEN ("
+    "  SELECT sum(greatest(p.reltuples, 0))::bigint FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid"
+    "  WHERE i.inhparent = c.oid"
+    ") ELSE c.reltuples::bigint END "
+    "FROM pg_class c WHERE c.oid = CAST(:name AS regclass)"
+)
+
+def approx_count(model):
+    if db.engine.dialect.name == 'postgresql':
+        estimate = db.session.scalar(RELTUPLES, {'name': model.__tablename__})
+        if estimate and estimate > 0:
+            return estimate
+    return db.session.query(func.count(model.id)).scalar()
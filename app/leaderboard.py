@@ -0,0 +1,179 @@
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from operator import itemgetter
+from sqlalchemy import select
+from models import db, Book, book_genre
+from queries import BookRef
+from rollups import daily_views
+
+log = logging.getLogger(__name__)
+
+LOOKUP_CHUNK = 10000
+
+class Leaderboard:
+    def __init__(self, app=None):
+        self.window   = 90
+        self.size     = 5
+        self.buckets  = {}
+        self.totals   = (Counter(), Counter())
+        self.titles   = {}
+        self.genres   = {}
+        self.version  = 0
+        self._today   = None
+        self._top     = {}
+        self._lock    = threading.Lock()
+        self._thread  = None
+        self._started = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LEADERBOARD_DAYS', 90)
+        app.config.setdefault('LEADERBOARD_SIZE', 5)
+        app.config.setdefault('LEADERBOARD_REFRESH', 1.0)
+        app.config.setdefault('LEADERBOARD_RESYNC', 300)
+        self.app     = app
+        self.window  = app.config['LEADERBOARD_DAYS']
+        self.size    = app.config['LEADERBOARD_SIZE']
+        self.refresh = app.config['LEADERBOARD_REFRESH']
+        self.resync  = app.config['LEADERBOARD_RESYNC']
+        app.extensions['leaderboard'] = self
+
+    def add(self, book_id, authenticated=False):
+        today = date.today()
+        with self._lock:
+            self._advance(today)
+            everyone, known = self.buckets.setdefault(today, (Counter(), Counter()))
+            everyone[book_id] += 1
+            self.totals[0][book_id] += 1
+            if authenticated:
+                known[book_id] += 1
+                self.totals[1][book_id] += 1
+            self.version += 1
+
+    def top(self, k=None, genre_id=None, authenticated_only=False):
+        self.ensure_worker()
+        k = k or self.size
+        key = (k, genre_id, authenticated_only)
+        cached = self._top.get(key)
+        if cached and (cached[0] == self.version or time.monotonic() - cached[1] < self.refresh):
+            return cached[2]
+        with self._lock:
+            self._advance(date.today())
+            version = self.version
+            counts = self.totals[1 if authenticated_only else 0]
+            unknown = [b for b in counts if b not in self.genres] if genre_id is not None else []
+        if unknown:
+            self._load(unknown, genres=True)
+        with self._lock:
+            if genre_id is None:
+                best = counts.most_common(k)
+            else:
+                best = heapq.nlargest(
+                    k, ((b, n) for b, n in counts.items() if genre_id in self.genres.get(b, ())),
+                    key=itemgetter(1),
+                )
+            missing = [b for b, _ in best if b not in self.titles]
+        if missing:
+            self._load(missing)
+        result = [(BookRef(b, self.titles[b]), n) for b, n in best if self.titles.get(b)]
+        self._top[key] = (version, time.monotonic(), result)
+        return result
+
+    def update_book(self, book_id, title, genre_ids):
+        with self._lock:
+            if book_id in self.titles:
+                self.titles[book_id] = title
+            if book_id in self.genres:
+                self.genres[book_id] = frozenset(genre_ids)
+            self.version += 1
+
+    def remove_book(self, book_id):
+        with self._lock:
+            self.titles.pop(book_id, None)
+            self.genres.pop(book_id, None)
+            for counts in self.totals:
+                counts.pop(book_id, None)
+            for bucket in self.buckets.values():
+                for counts in bucket:
+                    counts.pop(book_id, None)
+            self.version += 1
+
+    def _load(self, book_ids, genres=False):
+        found = {}
+        with self.app.app_context():
+            for i in range(0, len(book_ids), LOOKUP_CHUNK):
+                chunk = book_ids[i:i + LOOKUP_CHUNK]
+                if genres:
+                    found.update((b, set()) for b in chunk)
+                    rows = db.session.execute(
+                        select(book_genre.c.book_id, book_genre.c.genre_id).where(book_genre.c.book_id.in_(chunk))
+                    )
+                    for book_id, genre_id in rows:
+                        found[book_id].add(genre_id)
+                else:
+                    found.update(dict.fromkeys(chunk))
+                    found.update(db.session.execute(select(Book.id, Book.title).where(Book.id.in_(chunk))).all())
+            db.session.remove()
+        with self._lock:
+            if genres:
+                self.genres.update((b, frozenset(ids)) for b, ids in found.items())
+            else:
+                self.titles.update(found)
+
+    def warm(self):
+        today = date.today()
+        buckets = {}
+        totals = (Counter(), Counter())
+        for book_id, day, known, anonymous in db.session.execute(daily_views(today - timedelta(days=self.window))):
+            everyone, authenticated = buckets.setdefault(day, (Counter(), Counter()))
+            everyone[book_id] += known + anonymous
+            authenticated[book_id] += known
+            totals[0][book_id] += known + anonymous
+            totals[1][book_id] += known
+        db.session.remove()
+        with self._lock:
+            self.buckets, self.totals, self._today = buckets, totals, today
+            self.titles, self.genres = {}, {}
+            self.version += 1
+
+    def ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._started:
+            if self._thread is None:
+                self._warm()
+                self._thread = threading.Thread(target=self._run, name='leaderboard', daemon=True)
+                self._thread.start()
+
+    def _warm(self):
+        with self.app.app_context():
+            try:
+                self.warm()
+            except Exception:
+                log.exception('Не удалось загрузить рейтинг популярных книг')
+
+    def _run(self):
+        while True:
+            time.sleep(self.resync)
+            self._warm()
+
+    def _advance(self, today):
+        if today == self._today:
+            return
+        start = today - timedelta(days=self.window)
+        for day in [d for d in self.buckets if d < start]:
+            everyone, known = self.buckets.pop(day)
+            self.totals[0].subtract(everyone)
+            self.totals[1].subtract(known)
+        self.totals = (+self.totals[0], +self.totals[1])
+        self.titles = {b: t for b, t in self.titles.items() if b in self.totals[0]}
+        self.genres = {b: g for b, g in self.genres.items() if b in self.totals[0]}
+        self._today = today
+        self.version += 1
+
+leaderboard = Leaderboard()
@@ -0,0 +1,62 @@
+import hashlib
+import time
+from functools import lru_cache
+import markdown
+import bleach
+from blinker import Namespace
+from sqlalchemy import event
+from models import Book, Review
+
+BLEACH_TAGS = bleach.sanitizer.ALLOWED_TAGS.union({
+    'p','pre','code','h1','h2','h3','ul','ol','li','blockquote','img'
+})
+
+BLEACH_ATTRS = {
+    **bleach.sanitizer.ALLOWED_ATTRIBUTES,
+    'img': ['src','alt','title']
+}
+
+RENDER_FINGERPRINT = repr((
+    markdown.__version__,
+    sorted(BLEACH_TAGS),
+    sorted((tag, sorted(attrs)) for tag, attrs in BLEACH_ATTRS.items()),
+))
+
+markdown_rendered = Namespace().signal('markdown-rendered')
+
+@lru_cache(maxsize=512)
+def render_md(md_text):
+    started = time.perf_counter()
+    html = markdown.markdown(md_text)
+    html = bleach.clean(html, tags=BLEACH_TAGS, attributes=BLEACH_ATTRS)
+    markdown_rendered.send(None, elapsed=time.perf_counter() - started)
+    return html
+
+def md_hash(md_text):
+    return hashlib.sha1((RENDER_FINGERPRINT + md_text).encode('utf-8')).hexdigest()
+
+def refresh_html(obj, field):
+    source = getattr(obj, field)
+    digest = md_hash(source)
+    if getattr(obj, f'{field}_hash') == digest:
+        return False
+    setattr(obj, f'{field}_html', render_md(source))
+    setattr(obj, f'{field}_hash', digest)
+    return True
+
+def stored_html(obj, field):
+    source = getattr(obj, field)
+    html = getattr(obj, f'{field}_html')
+    if html is not None and getattr(obj, f'{field}_hash') == md_hash(source):
+        return html
+    return render_md(source)
+
+@event.listens_for(Book, 'before_insert')
+@event.listens_for(Book, 'before_update')
+def book_render(mapper, connection, book):
+    refresh_html(book, 'description')
+
+@event.listens_for(Review, 'before_insert')
+@event.listens_for(Review, 'before_update')
+def review_render(mapper, connection, review):
+    refresh_html(review, 'text')
@@ -0,0 +1,33 @@
+"""per-book review count and rating sum
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.add_column(sa.Column('review_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE books SET '
+        'review_count = (SELECT count(*) FROM reviews WHERE reviews.book_id = books.id), '
+        'rating_sum = (SELECT coalesce(sum(rating), 0) FROM reviews WHERE reviews.book_id = books.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_column('rating_sum')
+        batch_op.drop_column('review_count')
@@ -0,0 +1,33 @@
+"""daily rollup of book visits
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('visit_daily',
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('authenticated_views', sa.Integer(), nullable=False),
+    sa.Column('anonymous_views', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id', 'day')
+    )
+    op.create_index('ix_visit_daily_day', 'visit_daily', ['day'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_visit_daily_day', table_name='visit_daily')
+    op.drop_table('visit_daily')
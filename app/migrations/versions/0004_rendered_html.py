@@ -0,0 +1,34 @@
+"""stored html for book descriptions and reviews
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.add_column(sa.Column('description_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('description_hash', sa.String(length=40), nullable=True))
+    with op.batch_alter_table('reviews') as batch_op:
+        batch_op.add_column(sa.Column('text_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('text_hash', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('reviews') as batch_op:
+        batch_op.drop_column('text_hash')
+        batch_op.drop_column('text_html')
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_column('description_hash')
+        batch_op.drop_column('description_html')
@@ -0,0 +1,36 @@
+"""full-text search column and index on PostgreSQL
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("""
+        ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(author, '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(publisher, '')), 'C') ||
+            setweight(to_tsvector('russian', coalesce(description, '')), 'D')
+        ) STORED
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_books_search_vector")
+    op.execute("ALTER TABLE books DROP COLUMN IF EXISTS search_vector")
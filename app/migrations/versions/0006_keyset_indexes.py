@@ -0,0 +1,25 @@
+"""indexes for keyset pagination of books and visits
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 10:25:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_books_year_id', 'books', ['year', 'id'], unique=False)
+    op.create_index('ix_visits_timestamp_id', 'visits', ['timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_visits_timestamp_id', table_name='visits')
+    op.drop_index('ix_books_year_id', table_name='books')
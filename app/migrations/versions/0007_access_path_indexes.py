@@ -0,0 +1,69 @@
+"""access path indexes, visit_date and unique review per user
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+log = logging.getLogger('alembic.runtime.migration')
+
+RECOUNT = (
+    'UPDATE books SET '
+    'review_count = (SELECT count(*) FROM reviews WHERE reviews.book_id = books.id), '
+    'rating_sum = (SELECT coalesce(sum(rating), 0) FROM reviews WHERE reviews.book_id = books.id)'
+)
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.add_column(sa.Column('visit_date', sa.Date(), nullable=True))
+    op.execute('UPDATE visits SET visit_date = DATE("timestamp")')
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.alter_column('visit_date', existing_type=sa.Date(), nullable=False)
+        batch_op.drop_index('ix_visits_session_id')
+        batch_op.create_index('ix_visits_session_user_ts', ['session_id', 'user_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_visits_visit_date_book', ['visit_date', 'book_id'], unique=False)
+
+    op.create_index('ix_covers_book_id', 'covers', ['book_id'], unique=False)
+
+    op.execute(
+        'CREATE TABLE reviews_duplicates AS SELECT * FROM reviews WHERE id NOT IN '
+        '(SELECT min(id) FROM reviews GROUP BY book_id, user_id)'
+    )
+    duplicates = op.get_bind().execute(
+        sa.text('SELECT id, book_id, user_id FROM reviews_duplicates ORDER BY id')
+    ).all()
+    if duplicates:
+        log.warning('Повторные рецензии перенесены в reviews_duplicates (%d): %s', len(duplicates),
+                    ', '.join(f'#{id} (книга {book_id}, пользователь {user_id})' for id, book_id, user_id in duplicates))
+        op.execute('DELETE FROM reviews WHERE id IN (SELECT id FROM reviews_duplicates)')
+    op.execute(RECOUNT)
+    with op.batch_alter_table('reviews') as batch_op:
+        batch_op.create_unique_constraint('uq_reviews_book_user', ['book_id', 'user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('reviews') as batch_op:
+        batch_op.drop_constraint('uq_reviews_book_user', type_='unique')
+    op.execute('INSERT INTO reviews SELECT * FROM reviews_duplicates')
+    op.drop_table('reviews_duplicates')
+    op.execute(RECOUNT)
+
+    op.drop_index('ix_covers_book_id', table_name='covers')
+
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.drop_index('ix_visits_visit_date_book')
+        batch_op.drop_index('ix_visits_session_user_ts')
+        batch_op.create_index('ix_visits_session_id', ['session_id'], unique=False)
+        batch_op.drop_column('visit_date')
@@ -0,0 +1,25 @@
+"""drop session index on visits, recently viewed moved to the session
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.drop_index('ix_visits_session_user_ts')
+
+
+def downgrade():
+    with op.batch_alter_table('visits') as batch_op:
+        batch_op.create_index('ix_visits_session_user_ts', ['session_id', 'user_id', 'timestamp'], unique=False)
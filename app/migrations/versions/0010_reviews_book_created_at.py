@@ -0,0 +1,23 @@
+"""index reviews by book and creation time for keyset pagination
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_reviews_book_created_at', 'reviews', ['book_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_reviews_book_created_at', table_name='reviews')
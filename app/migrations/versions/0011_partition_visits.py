@@ -0,0 +1,78 @@
+"""partition visits by month on PostgreSQL
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from datetime import date, timedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'id, user_id, session_id, book_id, "timestamp", visit_date'
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def create_table(name, partitioned):
+    op.execute(f"""
+        CREATE TABLE {name} (
+            id integer NOT NULL DEFAULT nextval('visits_id_seq'),
+            user_id integer REFERENCES users (id) ON DELETE SET NULL,
+            session_id varchar(64) NOT NULL,
+            book_id integer NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+            "timestamp" timestamp without time zone NOT NULL,
+            visit_date date NOT NULL,
+            PRIMARY KEY ({'id, visit_date' if partitioned else 'id'})
+        ){' PARTITION BY RANGE (visit_date)' if partitioned else ''}
+    """)
+    op.execute(f"ALTER SEQUENCE visits_id_seq OWNED BY {name}.id")
+
+
+def swap(partitioned):
+    op.execute("ALTER TABLE visits RENAME TO visits_old")
+    op.execute("ALTER TABLE visits_old RENAME CONSTRAINT visits_pkey TO visits_old_pkey")
+    op.execute("DROP INDEX ix_visits_timestamp_id")
+    op.execute("DROP INDEX ix_visits_visit_date_book")
+    create_table('visits', partitioned)
+
+
+def finish():
+    op.execute(f"INSERT INTO visits ({COLUMNS}) SELECT {COLUMNS} FROM visits_old")
+    op.execute("DROP TABLE visits_old")
+    op.create_index('ix_visits_timestamp_id', 'visits', ['timestamp', 'id'], unique=False)
+    op.create_index('ix_visits_visit_date_book', 'visits', ['visit_date', 'book_id'], unique=False)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    swap(partitioned=True)
+    op.execute("CREATE TABLE visits_default PARTITION OF visits DEFAULT")
+
+    first = bind.scalar(sa.text("SELECT min(visit_date) FROM visits_old")) or date.today()
+    month, last = first.replace(day=1), next_month(next_month(next_month(date.today().replace(day=1))))
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE visits_p{month:%Y_%m} PARTITION OF visits "
+            f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+        )
+        month = next_month(month)
+    finish()
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    swap(partitioned=False)
+    finish()
@@ -1,10 +1,13 @@
-from datetime import datetime
+from datetime import date, datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin
+from flask_migrate import Migrate
 from sqlalchemy.orm import backref
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
+migrate = Migrate()
 
 class Role(db.Model):
     __tablename__ = 'roles'
@@ -33,9 +36,9 @@ class User(db.Model, UserMixin):
         from werkzeug.security import check_password_hash
         return check_password_hash(self.password_hash, pwd)
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+    @property
+    def role_name(self):
+        return self.role.name
 
 book_genre = db.Table(
     'book_genre',
@@ -50,42 +53,91 @@ class Genre(db.Model):
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (db.Index('ix_books_year_id', 'year', 'id'),)
     id          = db.Column(db.Integer, primary_key=True)
     title       = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=False)
+    description_html = db.Column(db.Text)
+    description_hash = db.Column(db.String(40))
     year        = db.Column(db.Integer, nullable=False)
     publisher   = db.Column(db.String(255), nullable=False)
     author      = db.Column(db.String(255), nullable=False)
     pages       = db.Column(db.Integer, nullable=False)
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum   = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     genres  = db.relationship('Genre', secondary=book_genre, backref='books')
     cover   = db.relationship('Cover', uselist=False, backref='book', cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='book', cascade='all, delete-orphan')
     visits  = db.relationship('Visit', backref=backref('book', passive_deletes=True), cascade='all, delete-orphan', passive_deletes=True)
 
+    @property
+    def rating_avg(self):
+        return self.rating_sum / self.review_count if self.review_count else 0
+
 class Cover(db.Model):
     __tablename__ = 'covers'
     id        = db.Column(db.Integer, primary_key=True)
     filename  = db.Column(db.String(255), nullable=False)
     mime_type = db.Column(db.String(50), nullable=False)
     md5_hash  = db.Column(db.String(64), unique=True, nullable=False)
-    book_id   = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    book_id   = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False, index=True)
 
 class Review(db.Model):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'user_id', name='uq_reviews_book_user'),
+        db.Index('ix_reviews_book_created_at', 'book_id', 'created_at', 'id'),
+    )
     id         = db.Column(db.Integer, primary_key=True)
     book_id    = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
     user_id    = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     rating     = db.Column(db.Integer, nullable=False)
     text       = db.Column(db.Text, nullable=False)
+    text_html  = db.Column(db.Text)
+    text_hash  = db.Column(db.String(40))
     created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
 
 class Visit(db.Model):
     __tablename__ = 'visits'
+    __table_args__ = (
+        db.Index('ix_visits_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_visits_visit_date_book', 'visit_date', 'book_id'),
+    )
     id         = db.Column(db.Integer, primary_key=True)
     user_id    = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
-    session_id = db.Column(db.String(64), nullable=False, index=True)
+    session_id = db.Column(db.String(64), nullable=False)
     book_id    = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
     timestamp  = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    visit_date = db.Column(db.Date, default=date.today, nullable=False)
+
+    user = db.relationship('User', backref='visits')
+
+class VisitDaily(db.Model):
+    __tablename__ = 'visit_daily'
+    book_id             = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    day                 = db.Column(db.Date, primary_key=True, index=True)
+    authenticated_views = db.Column(db.Integer, nullable=False, default=0)
+    anonymous_views     = db.Column(db.Integer, nullable=False, default=0)
+
+class CacheGeneration(db.Model):
+    __tablename__ = 'cache_generations'
+    namespace = db.Column(db.String(64), primary_key=True)
+    value     = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_created_at', 'status', 'created_at'),)
+    id          = db.Column(db.Integer, primary_key=True)
+    kind        = db.Column(db.String(50), nullable=False)
+    params      = db.Column(db.Text, nullable=False)
+    params_hash = db.Column(db.String(40), nullable=False, index=True)
+    status      = db.Column(db.String(20), nullable=False, default='pending')
+    user_id     = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
+    filename    = db.Column(db.String(255))
+    error       = db.Column(db.Text)
+    created_at  = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    started_at  = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
 
-    user = db.relationship('User', backref='visits')
\ No newline at end of file
+    user = db.relationship('User')
@@ -0,0 +1,130 @@
+import re
+from datetime import date, timedelta
+from sqlalchemy import delete, select, text
+from models import db, Visit
+from archive import visit_archive
+from rollups import compact_visits, rolled_until
+
+PARTITION_RE = re.compile(r'^visits_p(\d{4})_(\d{2})$')
+ARCHIVE_COLUMNS = 'id, book_id, user_id, session_id, "timestamp", visit_date'
+
+def month_start(day):
+    return day.replace(day=1)
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f'visits_p{month:%Y_%m}'
+
+def partition_month(name):
+    m = PARTITION_RE.match(name)
+    return date(int(m[1]), int(m[2]), 1) if m else None
+
+def partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.scalar(text("SELECT relkind FROM pg_class WHERE oid = 'visits'::regclass")) == 'p'
+
+def attached():
+    names = db.session.scalars(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'visits'::regclass"
+    ))
+    return sorted(filter(None, map(partition_month, names)))
+
+def detached():
+    names = db.session.scalars(text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+        "AND relname ~ '^visits_p[0-9]{4}_[0-9]{2}$'"
+    ))
+    return sorted(filter(None, map(partition_month, names)))
+
+def stale_default_months(current):
+    return sorted(db.session.scalars(text(
+        "SELECT DISTINCT CAST(date_trunc('month', visit_date) AS date) FROM visits_default WHERE visit_date < :current"
+    ), {'current': current}))
+
+def create_partition(month):
+    name, start, end = partition_name(month), month, next_month(month)
+    db.session.execute(text(f"CREATE TABLE {name} (LIKE visits INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    db.session.execute(text(
+        f"WITH moved AS (DELETE FROM visits_default "
+        f"WHERE visit_date >= '{start}' AND visit_date < '{end}' RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ))
+    db.session.execute(text(f"ALTER TABLE visits ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    db.session.commit()
+
+def archive_partition(month):
+    name = partition_name(month)
+    rows = db.session.execute(
+        text(f"SELECT {ARCHIVE_COLUMNS} FROM {name} ORDER BY \"timestamp\", id").execution_options(yield_per=10000)
+    )
+    count = visit_archive.write(month, rows)
+    db.session.execute(text(f"DROP TABLE {name}"))
+    db.session.commit()
+    return count
+
+def archive_rows(month):
+    bounds = (Visit.visit_date >= month, Visit.visit_date < next_month(month))
+    if db.session.scalar(select(Visit.id).where(*bounds).limit(1)) is None:
+        return 0
+    rows = db.session.execute(
+        select(Visit.id, Visit.book_id, Visit.user_id, Visit.session_id, Visit.timestamp, Visit.visit_date)
+        .where(*bounds)
+        .order_by(Visit.timestamp, Visit.id)
+        .execution_options(yield_per=10000)
+    )
+    count = visit_archive.write(month, rows)
+    db.session.execute(delete(Visit).where(*bounds))
+    db.session.commit()
+    return count
+
+def archivable(cutoff):
+    compact_visits()
+    watermark = rolled_until()
+    if watermark is None:
+        return None
+    return min(cutoff, month_start(watermark + timedelta(days=1)))
+
+def maintain_partitions(ahead, keep_months, today=None):
+    today = today or date.today()
+    current = month_start(today)
+    cutoff = archivable(add_months(current, -keep_months))
+    created, archived = [], {}
+
+    if partitioned():
+        existing, leftover = set(attached()), set(detached())
+        for month in (add_months(current, n) for n in range(ahead + 1)):
+            if month not in existing:
+                create_partition(month)
+                created.append(month)
+        for month in stale_default_months(current):
+            if month in leftover:
+                archived[month] = archive_rows(month)
+            else:
+                create_partition(month)
+                created.append(month)
+                existing.add(month)
+        if cutoff is not None:
+            for month in existing:
+                if month < cutoff:
+                    db.session.execute(text(f"ALTER TABLE visits DETACH PARTITION {partition_name(month)}"))
+                    db.session.commit()
+        for month in detached():
+            archived[month] = archived.get(month, 0) + archive_partition(month)
+    elif cutoff is not None:
+        first = db.session.scalar(select(Visit.visit_date).order_by(Visit.visit_date).limit(1))
+        month = month_start(first) if first else cutoff
+        while month < cutoff:
+            count = archive_rows(month)
+            if count:
+                archived[month] = count
+            month = next_month(month)
+
+    return created, archived
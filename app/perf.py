@@ -0,0 +1,181 @@
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from flask import g, has_app_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from models import db
+from markup import markdown_rendered
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+class EndpointStats:
+    def __init__(self):
+        self.buckets       = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count         = 0
+        self.latency_sum   = 0.0
+        self.sampled       = 0
+        self.sql_count     = 0
+        self.sql_time      = 0.0
+        self.template_time = 0.0
+        self.markdown_time = 0.0
+
+    def observe(self, latency):
+        self.count += 1
+        self.latency_sum += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+class RequestStats:
+    __slots__ = ('sql_count', 'sql_time', 'template_time', 'markdown_time', 'shapes', 'render_started')
+
+    def __init__(self):
+        self.sql_count      = 0
+        self.sql_time       = 0.0
+        self.template_time  = 0.0
+        self.markdown_time  = 0.0
+        self.shapes         = Counter()
+        self.render_started = []
+
+class PerfMonitor:
+    def __init__(self, app=None):
+        self.endpoints  = defaultdict(EndpointStats)
+        self.n_plus_one = deque(maxlen=50)
+        self._lock      = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PERF_SAMPLE_RATE', 0.1)
+        app.config.setdefault('PERF_N_PLUS_ONE', 10)
+        app.config.setdefault('PERF_METRICS_TOKEN', None)
+        self.sample_rate  = app.config['PERF_SAMPLE_RATE']
+        self.repeat_limit = app.config['PERF_N_PLUS_ONE']
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_start, app)
+        template_rendered.connect(self._render_end, app)
+        markdown_rendered.connect(self._markdown)
+        with app.app_context():
+            for engine in db.engines.values():
+                self.watch(engine)
+        app.extensions['perf_monitor'] = self
+
+    def watch(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._sql_start)
+        event.listen(engine, 'after_cursor_execute', self._sql_end)
+
+    def _current(self):
+        return g.get('_perf') if has_app_context() else None
+
+    def _start(self):
+        g._perf_started = time.perf_counter()
+        if random.random() < self.sample_rate:
+            g._perf = RequestStats()
+
+    def _finish(self, response):
+        started = g.pop('_perf_started', None)
+        if started is None:
+            return response
+        latency = time.perf_counter() - started
+        stats = g.pop('_perf', None)
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            ep = self.endpoints[endpoint]
+            ep.observe(latency)
+            if stats is not None:
+                ep.sampled       += 1
+                ep.sql_count     += stats.sql_count
+                ep.sql_time      += stats.sql_time
+                ep.template_time += stats.template_time
+                ep.markdown_time += stats.markdown_time
+                for shape, n in stats.shapes.items():
+                    if n > self.repeat_limit:
+                        self.n_plus_one.appendleft((time.time(), endpoint, n, shape))
+        return response
+
+    def _sql_start(self, conn, cursor, statement, parameters, context, executemany):
+        if self._current() is not None:
+            conn.info.setdefault('_perf_started', []).append(time.perf_counter())
+
+    def _sql_end(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is None or not conn.info.get('_perf_started'):
+            return
+        stats.sql_time += time.perf_counter() - conn.info['_perf_started'].pop()
+        stats.sql_count += 1
+        stats.shapes[WHITESPACE_RE.sub(' ', statement)[:300]] += 1
+
+    def _render_start(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None:
+            stats.render_started.append(time.perf_counter())
+
+    def _render_end(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None and stats.render_started:
+            stats.template_time += time.perf_counter() - stats.render_started.pop()
+
+    def _markdown(self, sender, elapsed, **extra):
+        stats = self._current()
+        if stats is not None:
+            stats.markdown_time += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            rows = []
+            for endpoint, ep in sorted(self.endpoints.items()):
+                sampled = ep.sampled or 1
+                rows.append({
+                    'endpoint':      endpoint,
+                    'count':         ep.count,
+                    'avg_ms':        ep.latency_sum / ep.count * 1000 if ep.count else 0,
+                    'p50_ms':        ep.quantile(0.5) * 1000,
+                    'p99_ms':        ep.quantile(0.99) * 1000,
+                    'sampled':       ep.sampled,
+                    'sql_count':     ep.sql_count / sampled,
+                    'sql_ms':        ep.sql_time / sampled * 1000,
+                    'template_ms':   ep.template_time / sampled * 1000,
+                    'markdown_ms':   ep.markdown_time / sampled * 1000,
+                })
+            return rows, list(self.n_plus_one)
+
+    def prometheus(self, extra=()):
+        lines = ['# TYPE library_request_seconds histogram']
+        with self._lock:
+            for endpoint, ep in sorted(self.endpoints.items()):
+                seen = 0
+                for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), ep.buckets):
+                    seen += n
+                    lines.append(f'library_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {seen}')
+                lines.append(f'library_request_seconds_sum{{endpoint="{endpoint}"}} {ep.latency_sum:.6f}')
+                lines.append(f'library_request_seconds_count{{endpoint="{endpoint}"}} {ep.count}')
+            for name, attr in (('sql_statements', 'sql_count'), ('sql_seconds', 'sql_time'),
+                               ('template_seconds', 'template_time'), ('markdown_seconds', 'markdown_time'),
+                               ('sampled_requests', 'sampled')):
+                lines.append(f'# TYPE library_{name}_total counter')
+                for endpoint, ep in sorted(self.endpoints.items()):
+                    lines.append(f'library_{name}_total{{endpoint="{endpoint}"}} {getattr(ep, attr)}')
+        for name, labels, value in extra:
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_str}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+perf_monitor = PerfMonitor()
@@ -0,0 +1,128 @@
+from collections import namedtuple
+from math import ceil
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, Book, Review, User
+from search import search_index
+from keyset import keyset_page, keyset_query, keyset_result, approx_count
+
+BookRef = namedtuple('BookRef', 'id title')
+BookRow = namedtuple('BookRow', 'id title year genres rating_avg review_count cover')
+
+CATALOGUE_OPTIONS = (selectinload(Book.genres), selectinload(Book.cover))
+REVIEWS_PER_PAGE = 10
+
+class Page:
+    def __init__(self, items, page, per_page, total):
+        self.items    = items
+        self.page     = page
+        self.per_page = per_page
+        self.total    = total
+
+    @property
+    def pages(self):
+        return max(1, ceil(self.total / self.per_page)) if self.per_page else 1
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        last = 0
+        for num in range(1, self.pages + 1):
+            if (num <= left_edge
+                    or self.page - left_current <= num <= self.page + right_current
+                    or num > self.pages - right_edge):
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+def catalogue_page(page, per_page=10):
+    return Book.query.options(*CATALOGUE_OPTIONS) \
+        .order_by(Book.year.desc(), Book.id.desc()) \
+        .paginate(page=page, per_page=per_page, error_out=False)
+
+def book_row(b):
+    return BookRow(
+        b.id, b.title, b.year, tuple(g.name for g in b.genres),
+        b.rating_avg, b.review_count, b.cover.filename if b.cover else None
+    )
+
+def search_page(page, search_term, per_page=10):
+    ids, total = search_index.search(search_term, (page - 1) * per_page, per_page)
+    books = {
+        b.id: b for b in
+        Book.query.options(*CATALOGUE_OPTIONS).filter(Book.id.in_(ids)).all()
+    } if ids else {}
+    return Page([book_row(books[bid]) for bid in ids if bid in books], page, per_page, total)
+
+def catalogue_summary(page, search_term='', per_page=10):
+    if search_term:
+        return search_page(page, search_term, per_page)
+    paginated = catalogue_page(page, per_page=per_page)
+    return Page([book_row(b) for b in paginated.items], paginated.page, paginated.per_page, paginated.total)
+
+def catalogue_keyset(after=None, before=None, per_page=10):
+    page = keyset_page(
+        Book.query.options(*CATALOGUE_OPTIONS),
+        Book.year, Book.id,
+        after=after, before=before, per_page=per_page,
+        total=approx_count(Book),
+    )
+    page.items = [book_row(b) for b in page.items]
+    return page
+
+def refs_select(book_ids):
+    return select(Book.id, Book.title).where(Book.id.in_(book_ids))
+
+def ordered_refs(rows, book_ids):
+    found = {row.id: BookRef(row.id, row.title) for row in rows}
+    return [found[book_id] for book_id in book_ids if book_id in found]
+
+def book_refs(book_ids):
+    if not book_ids:
+        return []
+    return ordered_refs(db.session.execute(refs_select(book_ids)), book_ids)
+
+def detail_select(book_id):
+    return (
+        select(Book)
+        .options(
+            joinedload(Book.cover),
+            selectinload(Book.genres),
+        )
+        .where(Book.id == book_id)
+    )
+
+def book_for_detail(book_id):
+    return db.first_or_404(detail_select(book_id))
+
+def reviews_query(book_id, after=None, per_page=REVIEWS_PER_PAGE):
+    query = select(
+        Review.id, Review.rating, Review.text, Review.text_html, Review.text_hash,
+        Review.created_at, User.last_name, User.first_name,
+    ).join(User, User.id == Review.user_id).where(Review.book_id == book_id)
+    return keyset_query(query, Review.created_at, Review.id, after=after, per_page=per_page)
+
+def reviews_result(rows, after, before, per_page=REVIEWS_PER_PAGE):
+    return keyset_result(list(rows), Review.created_at, Review.id, after, before, per_page)
+
+def reviews_page(book_id, after=None, per_page=REVIEWS_PER_PAGE):
+    query, after, before = reviews_query(book_id, after, per_page)
+    return reviews_result(db.session.execute(query).all(), after, before, per_page)
+
+def own_review_select(book_id, user_id):
+    return select(Review.id).where(Review.book_id == book_id, Review.user_id == user_id)
@@ -0,0 +1,20 @@
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+
+@contextmanager
+def count_queries(*engines):
+    statements = []
+    thread_id = threading.get_ident()
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread_id:
+            statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', on_execute)
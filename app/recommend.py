@@ -0,0 +1,269 @@
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from itertools import permutations
+from sqlalchemy import select
+from models import db, Visit
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'RECS1\n'
+
+def write_matrix(path, ids, counts, size, m, watermark):
+    header = json.dumps({
+        'size':      size,
+        'm':         m,
+        'watermark': watermark.isoformat() if watermark else None,
+        'byteorder': sys.byteorder,
+    }).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+    with open(path + '.part', 'wb') as out:
+        out.write(MAGIC)
+        out.write(struct.pack('<I', len(header)))
+        out.write(header)
+        ids.tofile(out)
+        counts.tofile(out)
+    os.replace(path + '.part', path)
+
+def read_header(path, buf):
+    if buf[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path}: не файл рекомендаций')
+    (size,) = struct.unpack_from('<I', buf, len(MAGIC))
+    start = len(MAGIC) + 4
+    header = json.loads(buf[start:start + size])
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'{path}: файл собран на машине с другим порядком байт')
+    return header, start, size
+
+class NeighbourMatrix:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header, start, size = read_header(path, buf)
+        except Exception:
+            buf.close()
+            raise
+        self.size, self.m = header['size'], header['m']
+        self.watermark = date.fromisoformat(header['watermark']) if header['watermark'] else None
+        data, n = start + size, header['size'] * header['m'] * 4
+        self._buf   = buf
+        self._view  = memoryview(buf)
+        self.ids    = self._view[data:data + n].cast('i')
+        self.counts = self._view[data + n:data + 2 * n].cast('I')
+
+    def close(self):
+        self.ids.release()
+        self.counts.release()
+        self._view.release()
+        self._buf.close()
+
+    def neighbours(self, book_id, k):
+        if not 0 < book_id < self.size:
+            return []
+        start = book_id * self.m
+        return [b for b in self.ids[start:start + min(k, self.m)] if b]
+
+def aggregate(rows, cols, vals=None):
+    span = int(max(rows.max(), cols.max())) + 1
+    keys, inverse = np.unique(rows * span + cols, return_inverse=True)
+    vals = np.bincount(inverse, weights=vals, minlength=len(keys)).astype(np.int64)
+    return keys // span, keys % span, vals
+
+def covisits(visitors, books, limit):
+    visitors = np.asarray(visitors, dtype=np.int64)
+    books    = np.asarray(books, dtype=np.int64)
+    if not len(books):
+        return None
+    span = int(books.max()) + 1
+    keys = np.unique(visitors * span + books)
+    owners, items = keys // span, keys % span
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+    rows, cols = [], []
+    for size in np.unique(sizes):
+        width = min(int(size), limit)
+        if width < 2:
+            continue
+        baskets = items[starts[sizes == size][:, None] + np.arange(width)]
+        i, j = np.triu_indices(width, 1)
+        a, b = baskets[:, i].ravel(), baskets[:, j].ravel()
+        rows += [a, b]
+        cols += [b, a]
+    if not rows:
+        return None
+    return aggregate(np.concatenate(rows), np.concatenate(cols))
+
+def merge_top(ids, counts, pairs, m):
+    parts = [pairs] if pairs is not None else []
+    if ids is not None and ids.size:
+        r, c = np.nonzero(ids)
+        parts.append((r.astype(np.int64), ids[r, c].astype(np.int64), counts[r, c].astype(np.int64)))
+    size = ids.shape[0] if ids is not None else 0
+    if not parts:
+        return np.zeros((size, m), np.int32), np.zeros((size, m), np.uint32)
+    rows, cols, vals = (np.concatenate(col) for col in zip(*parts))
+    size = max(size, int(max(rows.max(), cols.max())) + 1)
+    rows, cols, vals = aggregate(rows, cols, vals)
+    order = np.lexsort((cols, -vals, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < m
+    new_ids, new_counts = np.zeros((size, m), np.int32), np.zeros((size, m), np.uint32)
+    new_ids[rows[keep], rank[keep]] = cols[keep]
+    new_counts[rows[keep], rank[keep]] = np.minimum(vals[keep], 2 ** 32 - 1)
+    return new_ids, new_counts
+
+def covisits_py(visitors, books, limit):
+    baskets = defaultdict(set)
+    for visitor, book_id in zip(visitors, books):
+        baskets[visitor].add(book_id)
+    pairs = Counter()
+    for basket in baskets.values():
+        pairs.update(permutations(sorted(basket)[:limit], 2))
+    return pairs
+
+def merge_top_py(matrix, pairs, m):
+    for (a, b), n in pairs.items():
+        matrix[a][b] += n
+    size = max((max(a, max(row)) for a, row in matrix.items() if row), default=-1) + 1
+    ids, counts = array.array('i', bytes(4 * size * m)), array.array('I', bytes(4 * size * m))
+    for a, row in matrix.items():
+        best = sorted(row.items(), key=lambda item: (-item[1], item[0]))[:m]
+        for rank, (b, n) in enumerate(best):
+            ids[a * m + rank], counts[a * m + rank] = b, min(n, 2 ** 32 - 1)
+    return ids, counts, size
+
+def day_baskets(day, limit):
+    baskets, visitors, books = {}, array.array('q'), array.array('q')
+    rows = db.session.execute(
+        select(Visit.user_id, Visit.session_id, Visit.book_id)
+        .where(Visit.visit_date == day)
+        .order_by(Visit.timestamp.desc(), Visit.id.desc())
+        .execution_options(yield_per=10000)
+    )
+    for user_id, session_id, book_id in rows:
+        key = user_id if user_id is not None else session_id
+        if key not in baskets:
+            baskets[key] = (len(baskets), set())
+        visitor, basket = baskets[key]
+        if len(basket) >= limit or book_id in basket:
+            continue
+        basket.add(book_id)
+        visitors.append(visitor)
+        books.append(book_id)
+    return visitors, books
+
+class Recommender:
+    def __init__(self, app=None):
+        self._matrix  = None
+        self._stat    = None
+        self._checked = 0
+        self._lock    = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RECOMMEND_FILE', os.path.join(app.instance_path, 'recommendations.bin'))
+        app.config.setdefault('RECOMMEND_SIZE', 5)
+        app.config.setdefault('RECOMMEND_CANDIDATES', 20)
+        app.config.setdefault('RECOMMEND_BASKET_LIMIT', 30)
+        app.config.setdefault('RECOMMEND_DAYS', 180)
+        app.config.setdefault('RECOMMEND_MERGE_DAYS', 30)
+        app.config.setdefault('RECOMMEND_RELOAD', 60)
+        self.path         = app.config['RECOMMEND_FILE']
+        self.size         = app.config['RECOMMEND_SIZE']
+        self.candidates   = app.config['RECOMMEND_CANDIDATES']
+        self.basket_limit = app.config['RECOMMEND_BASKET_LIMIT']
+        self.days         = app.config['RECOMMEND_DAYS']
+        self.merge_days   = app.config['RECOMMEND_MERGE_DAYS']
+        self.reload       = app.config['RECOMMEND_RELOAD']
+        app.extensions['recommender'] = self
+
+    def similar(self, book_id, k=None):
+        self._refresh()
+        with self._lock:
+            return self._matrix.neighbours(book_id, k or self.size) if self._matrix is not None else []
+
+    def _refresh(self):
+        if time.monotonic() - self._checked < self.reload:
+            return
+        try:
+            st = os.stat(self.path)
+            stat = (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            stat = None
+        with self._lock:
+            self._checked = time.monotonic()
+            if stat == self._stat:
+                return
+            matrix = None
+            if stat is not None:
+                try:
+                    matrix = NeighbourMatrix(self.path)
+                except (OSError, ValueError):
+                    log.exception('Не удалось открыть файл рекомендаций')
+                    return
+            if self._matrix is not None:
+                self._matrix.close()
+            self._matrix, self._stat = matrix, stat
+
+    def build(self, full=False, today=None):
+        today = today or date.today()
+        current = None
+        if not full and os.path.exists(self.path):
+            current = NeighbourMatrix(self.path)
+            if current.m != self.candidates or current.watermark is None:
+                current.close()
+                current = None
+        start = current.watermark + timedelta(days=1) if current else today - timedelta(days=self.days)
+        days = [start + timedelta(days=n) for n in range((today - start).days)]
+        batches = [days[i:i + self.merge_days] for i in range(0, len(days), self.merge_days)]
+
+        if np is not None:
+            ids = counts = None
+            if current is not None:
+                ids = np.array(current.ids, dtype=np.int32).reshape(current.size, current.m)
+                counts = np.array(current.counts, dtype=np.uint32).reshape(current.size, current.m)
+            for batch in batches:
+                found = [p for p in (covisits(*day_baskets(day, self.basket_limit), self.basket_limit) for day in batch) if p is not None]
+                pairs = aggregate(*(np.concatenate(col) for col in zip(*found))) if found else None
+                ids, counts = merge_top(ids, counts, pairs, self.candidates)
+            if ids is None:
+                ids, counts = merge_top(None, None, None, self.candidates)
+            size, filled = ids.shape[0], int(np.count_nonzero(ids))
+        else:
+            matrix = defaultdict(Counter)
+            if current is not None:
+                for pos, b in enumerate(current.ids):
+                    if b:
+                        matrix[pos // current.m][b] = current.counts[pos]
+            pairs = Counter()
+            for day in days:
+                pairs.update(covisits_py(*day_baskets(day, self.basket_limit), self.basket_limit))
+            ids, counts, size = merge_top_py(matrix, pairs, self.candidates)
+            filled = sum(1 for b in ids if b)
+        if current is not None:
+            current.close()
+        db.session.remove()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_matrix(self.path, ids, counts, size, self.candidates, today - timedelta(days=1))
+        self._checked = 0
+        return len(days), filled
+
+recommender = Recommender()
@@ -0,0 +1,101 @@
+from datetime import date, timedelta
+from sqlalchemy import delete, func, insert, or_, select, union_all
+from models import db, Book, Visit, VisitDaily
+from archive import visit_archive
+
+def rolled_until():
+    return db.session.query(func.max(VisitDaily.day)).scalar()
+
+def compact_visits(full=False):
+    watermark = None if full else rolled_until()
+    today = date.today()
+
+    rows = (
+        select(
+            Visit.book_id,
+            Visit.visit_date,
+            func.count(Visit.user_id),
+            func.count(Visit.id) - func.count(Visit.user_id),
+        )
+        .where(Visit.visit_date < today)
+        .group_by(Visit.book_id, Visit.visit_date)
+    )
+    purge = delete(VisitDaily)
+    if watermark:
+        rows = rows.where(Visit.visit_date > watermark)
+        purge = purge.where(VisitDaily.day > watermark)
+
+    db.session.execute(purge)
+    res = db.session.execute(
+        insert(VisitDaily).from_select(
+            ['book_id', 'day', 'authenticated_views', 'anonymous_views'], rows
+        )
+    )
+    count = res.rowcount
+    if full:
+        archived = archived_daily(today)
+        if archived:
+            db.session.execute(insert(VisitDaily), archived)
+        count += len(archived)
+    db.session.commit()
+    return count
+
+def archived_daily(today):
+    first_live = db.session.scalar(select(func.min(Visit.visit_date)))
+    books = set(db.session.scalars(select(Book.id)))
+    return [row for row in visit_archive.daily(before=min(first_live or today, today)) if row['book_id'] in books]
+
+def views_by_book(date_from=None, date_to=None, authenticated_only=False):
+    return views_select(rolled_until(), date_from, date_to, authenticated_only)
+
+def views_select(watermark, date_from=None, date_to=None, authenticated_only=False):
+    parts = []
+
+    if watermark and not (date_from and date_from > watermark):
+        cnt = VisitDaily.authenticated_views
+        if not authenticated_only:
+            cnt = cnt + VisitDaily.anonymous_views
+        rolled = select(VisitDaily.book_id.label('book_id'), cnt.label('cnt')) \
+            .where(VisitDaily.day <= min(date_to or watermark, watermark))
+        if date_from:
+            rolled = rolled.where(VisitDaily.day >= date_from)
+        if authenticated_only:
+            rolled = rolled.where(VisitDaily.authenticated_views > 0)
+        parts.append(rolled)
+
+    raw_from = date_from
+    if watermark:
+        raw_from = max(date_from or watermark, watermark + timedelta(days=1))
+    if not parts or not (date_to and raw_from and date_to < raw_from):
+        raw = select(Visit.book_id.label('book_id'), func.count(Visit.id).label('cnt'))
+        if raw_from:
+            raw = raw.where(Visit.visit_date >= raw_from)
+        if date_to:
+            raw = raw.where(Visit.visit_date <= date_to)
+        if authenticated_only:
+            raw = raw.where(Visit.user_id.isnot(None))
+        parts.append(raw.group_by(Visit.book_id))
+
+    counts = union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+    return (
+        select(counts.c.book_id, func.sum(counts.c.cnt).label('cnt'))
+        .group_by(counts.c.book_id)
+        .subquery('views')
+    )
+
+def daily_views(date_from):
+    watermark = select(func.max(VisitDaily.day)).scalar_subquery()
+    rolled = select(
+        VisitDaily.book_id, VisitDaily.day, VisitDaily.authenticated_views, VisitDaily.anonymous_views,
+    ).where(VisitDaily.day >= date_from)
+    raw = (
+        select(
+            Visit.book_id,
+            Visit.visit_date,
+            func.count(Visit.user_id),
+            func.count(Visit.id) - func.count(Visit.user_id),
+        )
+        .where(Visit.visit_date >= date_from, or_(watermark.is_(None), Visit.visit_date > watermark))
+        .group_by(Visit.book_id, Visit.visit_date)
+    )
+    return union_all(rolled, raw)
@@ -0,0 +1,191 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from sqlalchemy import DDL, event, func, literal_column, select, text
+from models import db, Book
+from cache import result_cache
+
+FIELD_WEIGHTS = (('title', 'A', 1.0), ('author', 'B', 0.4), ('publisher', 'C', 0.2), ('description', 'D', 0.1))
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or '').lower())
+
+def search_vector_sql(ts_config):
+    parts = [
+        f"setweight(to_tsvector('{ts_config}', coalesce({field}, '')), '{weight}')"
+        for field, weight, _ in FIELD_WEIGHTS
+    ]
+    return ' || '.join(parts)
+
+def search_ddl(ts_config='russian'):
+    return [
+        f"ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS ({search_vector_sql(ts_config)}) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)",
+    ]
+
+for statement in search_ddl():
+    event.listen(Book.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+class PostgresSearch:
+    def __init__(self, ts_config='russian'):
+        self.ts_config = ts_config
+
+    def search(self, term, offset=0, limit=10):
+        vector = literal_column('books.search_vector')
+        query = func.websearch_to_tsquery(self.ts_config, term)
+        matches = vector.op('@@')(query)
+        total = db.session.scalar(select(func.count()).select_from(Book).where(matches))
+        ids = db.session.scalars(
+            select(Book.id)
+            .where(matches)
+            .order_by(func.ts_rank(vector, query).desc(), Book.year.desc())
+            .offset(offset)
+            .limit(limit)
+        ).all()
+        return ids, total
+
+    # search_vector is a generated column, so PostgreSQL keeps it in step with the row
+    def update(self, book):
+        pass
+
+    def remove(self, book_id):
+        pass
+
+    def rebuild(self):
+        for statement in search_ddl(self.ts_config):
+            db.session.execute(text(statement))
+        db.session.commit()
+
+class MemorySearch:
+    def __init__(self):
+        self._lock       = threading.Lock()
+        self._postings   = None
+        self._docs       = {}
+        self._vocabulary = []
+        self._generation = None
+
+    def search(self, term, offset=0, limit=10):
+        tokens = set(tokenize(term))
+        if not tokens:
+            return [], 0
+        generation = result_cache.generation('search')
+        with self._lock:
+            if self._postings is None or self._generation != generation:
+                self._build()
+                self._generation = generation
+            scores = None
+            for token in tokens:
+                postings = self._matches(token)
+                if scores is None:
+                    scores = dict(postings)
+                else:
+                    scores = {bid: s + postings[bid] for bid, s in scores.items() if bid in postings}
+                if not scores:
+                    return [], 0
+            ranked = sorted(scores, key=lambda bid: (-scores[bid], -self._docs[bid][0]))
+        return ranked[offset:offset + limit], len(ranked)
+
+    def update(self, book):
+        with self._lock:
+            if self._postings is None:
+                return
+            self._remove(book.id)
+            self._add(book.id, book.year, {field: getattr(book, field) for field, _, _ in FIELD_WEIGHTS})
+
+    def remove(self, book_id):
+        with self._lock:
+            if self._postings is not None:
+                self._remove(book_id)
+
+    def rebuild(self):
+        with self._lock:
+            self._build()
+
+    def _matches(self, prefix):
+        words = []
+        for i in range(bisect_left(self._vocabulary, prefix), len(self._vocabulary)):
+            if not self._vocabulary[i].startswith(prefix):
+                break
+            words.append(self._vocabulary[i])
+        if len(words) == 1:
+            return self._postings[words[0]]
+        matches = {}
+        for word in words:
+            for book_id, score in self._postings[word].items():
+                if score > matches.get(book_id, 0):
+                    matches[book_id] = score
+        return matches
+
+    def _build(self):
+        self._postings = defaultdict(dict)
+        self._docs = {}
+        self._vocabulary = None
+        fields = [field for field, _, _ in FIELD_WEIGHTS]
+        rows = db.session.execute(
+            select(Book.id, Book.year, *(getattr(Book, f) for f in fields))
+            .execution_options(yield_per=1000)
+        )
+        for row in rows:
+            self._add(row.id, row.year, {f: getattr(row, f) for f in fields})
+        self._vocabulary = sorted(self._postings)
+
+    def _add(self, book_id, year, values):
+        tokens = set()
+        for field, _, weight in FIELD_WEIGHTS:
+            for token in tokenize(values[field]):
+                if self._vocabulary is not None and token not in self._postings:
+                    insort(self._vocabulary, token)
+                postings = self._postings[token]
+                postings[book_id] = postings.get(book_id, 0) + weight
+                tokens.add(token)
+        self._docs[book_id] = (year, tokens)
+
+    def _remove(self, book_id):
+        _, tokens = self._docs.pop(book_id, (None, ()))
+        for token in tokens:
+            postings = self._postings[token]
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+class SearchIndex:
+    def __init__(self, app=None):
+        self._backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_TS_CONFIG', 'russian')
+        self.ts_config = app.config['SEARCH_TS_CONFIG']
+        app.extensions['search_index'] = self
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if db.engine.dialect.name == 'postgresql':
+                self._backend = PostgresSearch(self.ts_config)
+            else:
+                self._backend = MemorySearch()
+        return self._backend
+
+    def search(self, term, offset=0, limit=10):
+        return self.backend.search(term, offset, limit)
+
+    def update(self, book):
+        self.backend.update(book)
+
+    def remove(self, book_id):
+        self.backend.remove(book_id)
+
+    def rebuild(self):
+        self.backend.rebuild()
+
+    def invalidate(self):
+        result_cache.invalidate('search')
+
+search_index = SearchIndex()
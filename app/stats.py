@@ -1,81 +1,83 @@
-import csv
-from io import StringIO
-from datetime import datetime, timedelta
-import io
-from flask import Blueprint, render_template, request, redirect, send_file, url_for, flash
+import json
+from datetime import datetime
+from flask import Blueprint, Response, abort, current_app, render_template, request, redirect, send_file, stream_with_context, url_for, flash
 from flask_login import current_user
-from models import db, Visit, Book, User
-from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from models import Job, Visit
+from keyset import keyset_page, approx_count
+from perf import perf_monitor
+from visits import visit_recorder
+from cache import result_cache
+from exports import parse_period, visit_log_rows, views_rows, views_report, csv_chunks, EXPORTS, VISIT_LOG_HEADER, VIEWS_HEADER
+from jobs import job_queue, JOB_KINDS
 
 stats_bp = Blueprint('stats', __name__, template_folder='templates', url_prefix='/stats')
 
+def admin_denied():
+    if not current_user.is_authenticated or current_user.role_name!='admin':
+        flash('Недостаточно прав', 'warning')
+        return redirect(url_for('main.index'))
+
+def period_invalid(endpoint):
+    try:
+        parse_period(request.values.get('date_from'), request.values.get('date_to'))
+    except ValueError:
+        flash('Некорректный период', 'danger')
+        return redirect(url_for(endpoint))
+
 def admin_allowed(f):
     from functools import wraps
     @wraps(f)
     def wrapper(*a, **kw):
-        if not current_user.is_authenticated or current_user.role.name!='admin':
-            flash('Недостаточно прав', 'warning')
-            return redirect(url_for('main.index'))
-        return f(*a, **kw)
+        return admin_denied() or current_app.ensure_sync(f)(*a, **kw)
     return wrapper
 
+def csv_response(chunks, filename):
+    return Response(
+        stream_with_context(chunks),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
 @stats_bp.route('/', methods=['GET'])
 @stats_bp.route('/logs')
 @admin_allowed
 def stats_actions():
-    page = request.args.get('page', 1, type=int)
-    pagination = (Visit.query
-        .order_by(Visit.timestamp.desc())
-        .paginate(page=page, per_page=10, error_out=False)
+    pagination = keyset_page(
+        Visit.query.options(joinedload(Visit.user), joinedload(Visit.book)),
+        Visit.timestamp, Visit.id,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=10,
+        total=approx_count(Visit),
     )
     return render_template('stats_actions.html', pagination=pagination)
 
 @stats_bp.route('/logs/export')
 @admin_allowed
 def stats_actions_export():
-    visits = Visit.query.order_by(Visit.timestamp.desc()).all()
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(['№', 'Пользователь', 'Книга', 'Дата/Время'])
-    for i, v in enumerate(visits, 1):
-        user = f"{v.user.last_name} {v.user.first_name}" if v.user else "Неаутентифицированный"
-        writer.writerow([i, user, v.book.title, v.timestamp])
-    buf.seek(0)
-    return send_file(
-        io.BytesIO(buf.read().encode('utf-8-sig')),
-        as_attachment=True,
-        download_name=f"user_log_{datetime.utcnow().date()}.csv",
-        mimetype='text/csv'
+    invalid = period_invalid('stats.stats_actions')
+    if invalid:
+        return invalid
+    date_from, date_to = parse_period(request.values.get('date_from'), request.values.get('date_to'))
+    rows = visit_log_rows(date_from, date_to)
+    return csv_response(
+        csv_chunks(VISIT_LOG_HEADER, rows),
+        f"user_log_{datetime.utcnow().date()}.csv"
     )
 
 @stats_bp.route('/views', methods=['GET', 'POST'])
 @admin_allowed
 def stats_views():
+    invalid = period_invalid('stats.stats_views')
+    if invalid:
+        return invalid
     date_from = request.values.get('date_from')
     date_to   = request.values.get('date_to')
     page      = request.args.get('page', 1, type=int)
 
-    q = (
-        db.session
-        .query(
-            Book.id.label('id'),
-            Book.title.label('title'),
-            func.count(Visit.id).label('cnt')
-        )
-        .join(Visit)
-        .join(User)
-        .filter(User.id.isnot(None))
-    )
-    if date_from:
-        q = q.filter(Visit.timestamp >= date_from)
-    if date_to:
-        q = q.filter(Visit.timestamp < datetime.fromisoformat(date_to) + timedelta(days=1))
-
-    pagination = (
-        q.group_by(Book.id, Book.title)
-         .order_by(func.count(Visit.id).desc())
-         .paginate(page=page, per_page=10, error_out=False)
-    )
+    pagination = views_report(date_from, date_to) \
+        .paginate(page=page, per_page=10, error_out=False)
 
     return render_template(
         'stats_views.html',
@@ -88,40 +90,82 @@ def stats_views():
 @stats_bp.route('/views/export')
 @admin_allowed
 def stats_views_export():
+    invalid = period_invalid('stats.stats_views')
+    if invalid:
+        return invalid
     date_from = request.values.get('date_from')
     date_to   = request.values.get('date_to')
 
-    q = (
-        db.session
-        .query(
-            Book.id.label('id'),
-            Book.title.label('title'),
-            func.count(Visit.id).label('cnt')
-        )
-        .join(Visit)
-        .join(User)
-        .filter(User.id.isnot(None))
+    rows = views_rows(views_report(date_from, date_to))
+    return csv_response(
+        csv_chunks(VIEWS_HEADER, rows),
+        f"visits_actions_{datetime.utcnow().date()}.csv"
     )
-    if date_from:
-        q = q.filter(Visit.timestamp >= date_from)
-    if date_to:
-        q = q.filter(Visit.timestamp < datetime.fromisoformat(date_to) + timedelta(days=1))
-
-    rows = (
-        q.group_by(Book.id, Book.title)
-         .order_by(func.count(Visit.id).desc())
-         .all()
+
+
+@stats_bp.route('/jobs', methods=['GET', 'POST'])
+@admin_allowed
+def stats_jobs():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        if kind not in EXPORTS:
+            abort(400)
+        invalid = period_invalid('stats.stats_jobs')
+        if invalid:
+            return invalid
+        params = {
+            'date_from': request.form.get('date_from') or None,
+            'date_to':   request.form.get('date_to') or None,
+        }
+        job, created = job_queue.enqueue(kind, params, current_user.id)
+        flash(
+            f'Задача №{job.id} поставлена в очередь.' if created
+            else f'Такая задача уже в очереди (№{job.id}).',
+            'success' if created else 'info'
+        )
+        return redirect(url_for('stats.stats_jobs'))
+
+    job_queue.ensure_worker()
+    jobs = Job.query.order_by(Job.id.desc()).limit(50).all()
+    for job in jobs:
+        job.period = json.loads(job.params)
+    return render_template(
+        'stats_jobs.html',
+        jobs=jobs,
+        exports=EXPORTS,
+        kinds=JOB_KINDS,
+        active=any(job.status in ('pending', 'running') for job in jobs),
     )
 
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(['№', 'Книга', 'Просмотров'])
-    for i, (_, title, cnt) in enumerate(rows, 1):
-        writer.writerow([i, title, cnt])
-    buf.seek(0)
-    return send_file(
-        io.BytesIO(buf.read().encode('utf-8-sig')),
-        as_attachment=True,
-        download_name=f"visits_actions_{datetime.utcnow().date()}.csv",
-        mimetype='text/csv'
+@stats_bp.route('/jobs/<int:job_id>/download')
+@admin_allowed
+def stats_job_download(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'done':
+        abort(404)
+    return send_file(job_queue.path(job), mimetype='application/gzip',
+                     as_attachment=True, download_name=job.filename)
+
+@stats_bp.route('/perf')
+@admin_allowed
+def stats_perf():
+    endpoints, n_plus_one = perf_monitor.snapshot()
+    return render_template(
+        'stats_perf.html',
+        endpoints=endpoints,
+        n_plus_one=n_plus_one,
+        sample_rate=perf_monitor.sample_rate,
+        visits=dict(visit_recorder.metrics),
+        cache=dict(result_cache.metrics),
     )
+
+@stats_bp.route('/metrics')
+def stats_metrics():
+    token = current_app.config['PERF_METRICS_TOKEN']
+    bearer = request.headers.get('Authorization', '')
+    if not (token and bearer == f'Bearer {token}'):
+        if not current_user.is_authenticated or current_user.role_name != 'admin':
+            return Response('Forbidden\n', status=403, mimetype='text/plain')
+    extra = [('library_visits_total', {'event': k}, v) for k, v in sorted(visit_recorder.metrics.items())]
+    extra += [('library_cache_total', {'event': k}, v) for k, v in sorted(result_cache.metrics.items())]
+    return Response(perf_monitor.prometheus(extra), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,139 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, Visit
+
+log = logging.getLogger(__name__)
+
+class MemoryVisitCounter:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock    = threading.Lock()
+        self._day     = None
+        self._counts  = {}
+
+    def incr(self, key, day):
+        with self._lock:
+            if day != self._day:
+                self._day, self._counts = day, {}
+            n = self._counts.pop(key, 0) + 1
+            self._counts[key] = n
+            if len(self._counts) > self.max_keys:
+                del self._counts[next(iter(self._counts))]
+            return n
+
+class VisitRecorder:
+    def __init__(self, app=None, counter=None):
+        self.counter  = counter or MemoryVisitCounter()
+        self.metrics  = Counter()
+        self._queue   = None
+        self._thread  = None
+        self._started = threading.Lock()
+        self._stop    = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISITS_MAX_PER_DAY', 10)
+        app.config.setdefault('VISITS_QUEUE_SIZE', 10000)
+        app.config.setdefault('VISITS_BATCH_SIZE', 500)
+        app.config.setdefault('VISITS_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('VISITS_COUNTER_KEYS', 100000)
+        self.app            = app
+        self.max_per_day    = app.config['VISITS_MAX_PER_DAY']
+        self.batch_size     = app.config['VISITS_BATCH_SIZE']
+        self.flush_interval = app.config['VISITS_FLUSH_INTERVAL']
+        self._queue         = queue.Queue(maxsize=app.config['VISITS_QUEUE_SIZE'])
+        if isinstance(self.counter, MemoryVisitCounter):
+            self.counter.max_keys = app.config['VISITS_COUNTER_KEYS']
+        app.extensions['visit_recorder'] = self
+
+    def record(self, book_id, session_id, user_id=None):
+        user_id = int(user_id) if user_id else None
+        now = datetime.now()
+        today = now.date()
+        if self.counter.incr((session_id, book_id, user_id), today) > self.max_per_day:
+            self.metrics['capped'] += 1
+            return False
+        try:
+            self._queue.put_nowait({
+                'book_id':    book_id,
+                'session_id': session_id,
+                'user_id':    user_id,
+                'timestamp':  now,
+                'visit_date': today,
+            })
+        except queue.Full:
+            self.metrics['dropped'] += 1
+            return False
+        self.metrics['accepted'] += 1
+        self._ensure_worker()
+        return True
+
+    def flush(self):
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 5)
+        self.flush()
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._started:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='visit-recorder', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write([first] + self._drain(self.batch_size - 1))
+
+    def _drain(self, limit=None):
+        limit = self.batch_size if limit is None else limit
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self.app.app_context():
+            if self._insert(batch):
+                self.metrics['batches'] += 1
+                return
+            failed = batch if len(batch) == 1 else [row for row in batch if not self._insert([row])]
+            self.metrics['failed'] += len(failed)
+            if failed:
+                log.warning('Отброшено %d из %d посещений (книги %s)', len(failed), len(batch),
+                            ', '.join(sorted({str(row['book_id']) for row in failed})))
+
+    def _insert(self, rows):
+        try:
+            db.session.execute(insert(Visit).values(rows))
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            log.debug('Не удалось записать %d посещений: %s', len(rows), exc)
+            return False
+        self.metrics['flushed'] += len(rows)
+        return True
+
+visit_recorder = VisitRecorder()